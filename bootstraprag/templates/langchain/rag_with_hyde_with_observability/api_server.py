@@ -57,8 +57,24 @@ class SimpleRAGServingAPI(ls.LitAPI, ABC):
         return {'response': output}
 
 
+class SimpleRAGStreamingAPI(SimpleRAGServingAPI):
+    def predict(self, query: str):
+        source_documents, tokens = self.advanced_rag.execute_pipeline_stream(user_query=query)
+        for token in tokens:
+            yield {'token': token}
+        # the retrieved context is sent once generation is finished
+        yield {'source_nodes': [{'text': doc.page_content, 'metadata': doc.metadata} for doc in source_documents]}
+
+    def encode_response(self, output_stream, **kwargs):
+        for output in output_stream:
+            yield output
+
+
 if __name__ == '__main__':
-    api = SimpleRAGServingAPI()
+    # stream tokens as they are generated instead of returning the full completion
+    is_streaming = os.environ.get('LIT_SERVER_STREAM') == 'true'
+    api = SimpleRAGStreamingAPI() if is_streaming else SimpleRAGServingAPI()
     server = ls.LitServer(lit_api=api, api_path='/api/v1/chat-completion',
-                          workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')))
+                          workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')),
+                          stream=is_streaming)
     server.run(port=os.environ.get('LIT_SERVER_PORT'))
@@ -76,11 +76,14 @@ class RetrievalAugmentationGenerationUsingHyDE:
                 embedding=embeddings
             )
 
-    def execute_pipeline(self, user_query):
-        retriever = self.vector_store.as_retriever(
+    def _retriever(self):
+        return self.vector_store.as_retriever(
             search_type="similarity_score_threshold",
             search_kwargs={'score_threshold': 0.8}
         )
+
+    def execute_pipeline(self, user_query):
+        retriever = self._retriever()
         prompt = ChatPromptTemplate.from_template(self.prompt_template)
         chain = (
                 {"context": retriever, "question": RunnablePassthrough()}
@@ -89,3 +92,10 @@ class RetrievalAugmentationGenerationUsingHyDE:
                 | StrOutputParser()
         )
         return chain.invoke(user_query)
+
+    def execute_pipeline_stream(self, user_query):
+        # documents are retrieved up front so they can be returned next to the streamed answer
+        documents = self._retriever().invoke(user_query)
+        prompt = ChatPromptTemplate.from_template(self.prompt_template)
+        chain = prompt | self.llm | StrOutputParser()
+        return documents, chain.stream({"context": documents, "question": user_query})
@@ -10,7 +10,7 @@ from langchain.prompts import ChatPromptTemplate
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import Distance, VectorParams, PointStruct
-from typing import Any, List
+from typing import Any, Dict, Iterator, List
 from uuid import uuid4
 from dotenv import load_dotenv, find_dotenv
 from custom_templates import chat_prompt_template
@@ -108,3 +108,7 @@ class SimpleRAG:
     def query(self, user_query: str) -> str:
         result = self.retrieval_chain.invoke({"input": user_query})
         return result["answer"]
+
+    def query_stream(self, user_query: str) -> Iterator[Dict[str, Any]]:
+        # the retrieval chain emits the retrieved 'context' first, followed by 'answer' chunks as they are generated
+        return self.retrieval_chain.stream({"input": user_query})
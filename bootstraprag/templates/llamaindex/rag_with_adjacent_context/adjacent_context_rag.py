@@ -67,7 +67,8 @@ class PrevNextPostprocessorDemo:
             raise ValueError("Nodes are not parsed. Call parse_documents_to_nodes first.")
         self.index = VectorStoreIndex(self.nodes, storage_context=self.storage_context)
 
-    def query_with_postprocessor(self, query, num_nodes=4, top_k=1, response_mode="tree_summarize"):
+    def query_with_postprocessor(self, query, num_nodes=4, top_k=1, response_mode="tree_summarize",
+                                 streaming=False):
         """
         Query the index with a PrevNextNodePostprocessor.
 
@@ -76,6 +77,7 @@ class PrevNextPostprocessorDemo:
             num_nodes (int): Number of adjacent nodes to include in postprocessing.
             top_k (int): Number of top results to consider.
             response_mode (str): Response mode for the query engine.
+            streaming (bool): Return a StreamingResponse that yields tokens as they are generated.
 
         Returns:
             str: Query response.
@@ -89,6 +91,7 @@ class PrevNextPostprocessorDemo:
             similarity_top_k=top_k,
             node_postprocessors=[node_postprocessor],
             response_mode=response_mode,
+            streaming=streaming,
         )
         response: Response = query_engine.query(query)
         return response
@@ -30,8 +30,25 @@ class AdjacentContextRAG(lit.LitAPI, ABC):
         return {"assistant": output}
 
 
+class AdjacentContextStreamingRAG(AdjacentContextRAG):
+    def predict(self, x, **kwargs):
+        streaming_response = self.demo.query_with_postprocessor(query=x, streaming=True)
+        for token in streaming_response.response_gen:
+            yield {'token': token}
+        # the retrieved context is sent once generation is finished
+        yield {'source_nodes': [{'text': node.get_content(), 'score': node.score, 'metadata': node.metadata}
+                                for node in streaming_response.source_nodes]}
+
+    def encode_response(self, output_stream, **kwargs):
+        for output in output_stream:
+            yield output
+
+
 if __name__ == '__main__':
-    api = AdjacentContextRAG()
+    # stream tokens as they are generated instead of returning the full completion
+    is_streaming = os.environ.get('LIT_SERVER_STREAM') == 'true'
+    api = AdjacentContextStreamingRAG() if is_streaming else AdjacentContextRAG()
     server = lit.LitServer(api, api_path='/api/v1/chat/completion',
-                           workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')))
+                           workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')),
+                           stream=is_streaming)
     server.run(port=os.environ.get('LIT_SERVER_PORT'), num_api_servers=1, generate_client_file=False, log_level="info")
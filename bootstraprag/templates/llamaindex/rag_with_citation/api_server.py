@@ -27,8 +27,25 @@ class CitationRAGAPI(ls.LitAPI, ABC):
         return {'assistant': output}
 
 
+class CitationRAGStreamingAPI(CitationRAGAPI):
+    def predict(self, query: str):
+        streaming_response = self.citation_rag.query_stream(question=query)
+        for token in streaming_response.response_gen:
+            yield {'token': token}
+        # the cited sources are sent once generation is finished
+        yield {'source_nodes': [{'text': node.get_content(), 'score': node.score, 'metadata': node.metadata}
+                                for node in streaming_response.source_nodes]}
+
+    def encode_response(self, output_stream, **kwargs):
+        for output in output_stream:
+            yield output
+
+
 if __name__ == '__main__':
-    api = CitationRAGAPI()
+    # stream tokens as they are generated instead of returning the full completion
+    is_streaming = os.environ.get('LIT_SERVER_STREAM') == 'true'
+    api = CitationRAGStreamingAPI() if is_streaming else CitationRAGAPI()
     server = ls.LitServer(lit_api=api, api_path='/api/v1/chat/completion',
-                          workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')))
+                          workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')),
+                          stream=is_streaming)
     server.run(port=os.environ.get('LIT_SERVER_PORT'))
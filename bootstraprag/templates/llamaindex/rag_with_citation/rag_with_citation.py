@@ -49,6 +49,13 @@ class CitationQueryEngineRAG:
             similarity_top_k=3,
             citation_chunk_size=256,
         )
+        # same retriever and citation prompts, but the synthesizer streams tokens as they are generated
+        self.streaming_query_engine = CitationQueryEngine.from_args(
+            self.index,
+            similarity_top_k=3,
+            citation_chunk_size=256,
+            streaming=True,
+        )
 
     def _initialize_settings(self):
         """
@@ -88,3 +95,9 @@ class CitationQueryEngineRAG:
         Queries the MLOps query engine.
         """
         return self.query_engine.query(question)
+
+    def query_stream(self, question):
+        """
+        Queries the MLOps query engine, returning a StreamingResponse with the cited source nodes.
+        """
+        return self.streaming_query_engine.query(question)
@@ -8,6 +8,7 @@ from llama_index.core import (
 from llama_index.core.query_engine import FLAREInstructQueryEngine
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.schema import TextNode, MetadataMode
+from llama_index.core.async_utils import asyncio_run
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 from llama_index.embeddings.ollama import OllamaEmbedding
 # enable if you are using openai
@@ -18,6 +19,8 @@ from llama_index.llms.ollama import Ollama
 from llama_index.core.base.response.schema import Response, StreamingResponse, AsyncStreamingResponse, PydanticResponse
 from rag_evaluator import RAGEvaluator
 import qdrant_client
+import asyncio
+import hashlib
 import logging
 from dotenv import load_dotenv, find_dotenv
 from typing import Union
@@ -27,6 +30,9 @@ _ = load_dotenv(find_dotenv())
 logging.basicConfig(level=int(os.environ['INFO']))
 logger = logging.getLogger(__name__)
 
+# payload key holding the fingerprint of the corpus a collection was built from
+CORPUS_FINGERPRINT_KEY = 'corpus_fingerprint'
+
 
 class BaseRAG:
     RESPONSE_TYPE = Union[
@@ -35,21 +41,26 @@ class BaseRAG:
 
     def __init__(self, data_path: str, chunk_size: int = 512, chunk_overlap: int = 200,
                  required_exts: list[str] = ['.pdf', '.txt'],
-                 show_progress: bool = False, similarity_top_k: int = 3, max_iterations: int = 5):
-        # load the local data directory and chunk the data for further processing
-        self.docs = SimpleDirectoryReader(input_dir=data_path, required_exts=required_exts).load_data(
-            show_progress=show_progress)
+                 show_progress: bool = False, similarity_top_k: int = 3, max_iterations: int = 5,
+                 embed_batch_size: int = 32, max_concurrent_batches: int = 4):
+        self.data_path = data_path
+        self.required_exts = required_exts
+        self.show_progress = show_progress
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.docs = []
         self.text_parser = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
         # Create a local Qdrant vector store
         logger.info("initializing the vector store related objects")
-        client = qdrant_client.QdrantClient(url=os.environ['DB_URL'], api_key=os.environ['DB_API_KEY'])
-        self.vector_store = QdrantVectorStore(client=client, collection_name=os.environ['COLLECTION_NAME'])
+        self.client = qdrant_client.QdrantClient(url=os.environ['DB_URL'], api_key=os.environ['DB_API_KEY'])
+        self.vector_store = QdrantVectorStore(client=self.client, collection_name=os.environ['COLLECTION_NAME'])
 
         # use your prefered vector embeddings model
         logger.info("initializing the OllamaEmbedding")
         embed_model = OllamaEmbedding(model_name=os.environ['OLLAMA_EMBED_MODEL'],
-                                      base_url=os.environ['OLLAMA_BASE_URL'])
+                                      base_url=os.environ['OLLAMA_BASE_URL'],
+                                      embed_batch_size=embed_batch_size)
         # openai embeddings, embedding_model_name="text-embedding-3-large"
         # embed_model = OpenAIEmbedding(embed_batch_size=10, model=embedding_model_name)
 
@@ -69,13 +80,51 @@ class BaseRAG:
         self.nodes = []
 
         self.similarity_top_k = similarity_top_k
+        self.embed_batch_size = embed_batch_size
+        self.max_concurrent_batches = max_concurrent_batches
         self.flare_query_engine = None
         self.max_iterations = max_iterations
 
-        # preprocess the data like chunking, nodes, metadata etc
-        self._pre_process()
+        # skip reading, chunking and embedding when the collection already holds this exact corpus
+        self.corpus_fingerprint = self._corpus_fingerprint()
+        if self._is_collection_current():
+            logger.info("collection is up to date with the corpus, loading the existing index")
+            self._create_index_and_retriever()
+        else:
+            # preprocess the data like chunking, nodes, metadata etc
+            self._pre_process()
+
+    def _corpus_fingerprint(self) -> str:
+        # listing the files does not read or parse them, only their raw bytes are hashed
+        input_files = SimpleDirectoryReader(input_dir=self.data_path, required_exts=self.required_exts).input_files
+        sha256 = hashlib.sha256()
+        sha256.update(f"{os.environ['OLLAMA_EMBED_MODEL']}:{self.chunk_size}:{self.chunk_overlap}".encode())
+        for input_file in sorted(str(f) for f in input_files):
+            sha256.update(os.path.relpath(input_file, self.data_path).encode())
+            with open(input_file, 'rb') as fp:
+                for block in iter(lambda: fp.read(1 << 20), b''):
+                    sha256.update(block)
+        return sha256.hexdigest()
+
+    def _is_collection_current(self) -> bool:
+        collection_name = os.environ['COLLECTION_NAME']
+        if not self.client.collection_exists(collection_name=collection_name):
+            return False
+        points, _ = self.client.scroll(collection_name=collection_name, limit=1, with_payload=True)
+        return bool(points) and points[0].payload.get(CORPUS_FINGERPRINT_KEY) == self.corpus_fingerprint
 
     def _pre_process(self):
+        collection_name = os.environ['COLLECTION_NAME']
+        if self.client.collection_exists(collection_name=collection_name):
+            logger.info("corpus has changed since the collection was built, re-indexing from scratch")
+            self.client.delete_collection(collection_name=collection_name)
+            # the store cached that the collection existed, a fresh one recreates it on the first upsert
+            self.vector_store = QdrantVectorStore(client=self.client, collection_name=collection_name)
+
+        # load the local data directory and chunk the data for further processing
+        self.docs = SimpleDirectoryReader(input_dir=self.data_path, required_exts=self.required_exts).load_data(
+            show_progress=self.show_progress)
+
         logger.info("enumerating docs")
         for doc_idx, doc in enumerate(self.docs):
             curr_text_chunks = self.text_parser.split_text(doc.text)
@@ -86,28 +135,51 @@ class BaseRAG:
         for idx, text_chunk in enumerate(self.text_chunks):
             node = TextNode(text=text_chunk)
             src_doc = self.docs[self.doc_ids[idx]]
-            node.metadata = src_doc.metadata
+            node.metadata = {**src_doc.metadata, CORPUS_FINGERPRINT_KEY: self.corpus_fingerprint}
+            node.excluded_embed_metadata_keys = [CORPUS_FINGERPRINT_KEY]
+            node.excluded_llm_metadata_keys = [CORPUS_FINGERPRINT_KEY]
             self.nodes.append(node)
 
-        logger.info("enumerating nodes")
-        for node in self.nodes:
-            node_embedding = Settings.embed_model.get_text_embedding(
-                node.get_content(metadata_mode=MetadataMode.ALL)
-            )
-            node.embedding = node_embedding
+        logger.info("embedding nodes")
+        self._embed_nodes()
 
         # create vector store, index documents and creates retriever
         self._create_index_and_retriever()
 
+    def _embed_nodes(self):
+        # EMBED honours excluded_embed_metadata_keys, so the corpus fingerprint stays out of the vectors
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in self.nodes]
+        batches = [texts[i:i + self.embed_batch_size] for i in range(0, len(texts), self.embed_batch_size)]
+        logger.info(f"embedding {len(texts)} nodes in {len(batches)} batches of up to {self.embed_batch_size}")
+
+        async def _embed_all():
+            # bound the number of batches in flight so the embedding server is not flooded
+            semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+
+            async def _embed_batch(batch):
+                async with semaphore:
+                    return await Settings.embed_model.aget_text_embedding_batch(batch)
+
+            return await asyncio.gather(*[_embed_batch(batch) for batch in batches])
+
+        batch_embeddings = asyncio_run(_embed_all())
+
+        embeddings = [embedding for batch_embedding in batch_embeddings for embedding in batch_embedding]
+        for node, embedding in zip(self.nodes, embeddings):
+            node.embedding = embedding
+
     def _create_index_and_retriever(self):
         logger.info("initializing the storage context")
         storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
         logger.info("indexing the nodes in VectorStoreIndex")
-        index = VectorStoreIndex(
-            nodes=self.nodes,
-            storage_context=storage_context,
-            transformations=Settings.transformations,
-        )
+        if self.nodes:
+            index = VectorStoreIndex(
+                nodes=self.nodes,
+                storage_context=storage_context,
+                transformations=Settings.transformations,
+            )
+        else:
+            index = VectorStoreIndex.from_vector_store(vector_store=self.vector_store)
 
         self.flare_query_engine = FLAREInstructQueryEngine(
             query_engine=index.as_query_engine(similarity_top_k=self.similarity_top_k),
@@ -3,10 +3,16 @@ from deepeval.integrations.llama_index import (
     DeepEvalAnswerRelevancyEvaluator,
     DeepEvalContextualRelevancyEvaluator
 )
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv, find_dotenv
-from typing import Any
-import os
+from typing import Any, Dict, List
+import threading
 import logging
+import random
+import queue
+import json
+import time
+import os
 
 _ = load_dotenv(find_dotenv())
 logging.basicConfig(level=int(os.environ['INFO']))
@@ -19,16 +25,66 @@ class RAGEvaluator:
         self.answer_relevancy_evaluator = DeepEvalAnswerRelevancyEvaluator()
         self.context_relevancy_evaluator = DeepEvalContextualRelevancyEvaluator()
 
+        # 'sync' evaluates on the request path, 'async' hands a sample of requests to background workers
+        self.evaluation_mode = os.environ.get('EVALUATION_MODE', 'sync')
+        self.sample_rate = float(os.environ.get('EVALUATION_SAMPLE_RATE', 1.0))
+        self.sink_path = os.environ.get('EVALUATION_SINK_PATH')
+        self._sink_lock = threading.Lock()
+
+        if self.evaluation_mode == 'async':
+            num_workers = int(os.environ.get('EVALUATION_WORKERS', 2))
+            self._queue = queue.Queue(maxsize=int(os.environ.get('EVALUATION_QUEUE_SIZE', 100)))
+            # each worker runs the three evaluators concurrently
+            self._executor = ThreadPoolExecutor(max_workers=3 * num_workers)
+            for _ in range(num_workers):
+                threading.Thread(target=self._drain_queue, daemon=True).start()
+
     def evaluate(self, user_query: str, response_obj: Any):
         logger.info(f"calling evaluation, user_query: {user_query}, response_obj: {response_obj}")
         retrieval_context = [node.get_content() for node in response_obj.source_nodes]
         actual_output = response_obj.response
-        faithfulness_evaluation_response = self.faithfulness_evaluator.evaluate(query=user_query, response=actual_output,
-                                                                                contexts=retrieval_context)
-        answer_relevancy_response = self.answer_relevancy_evaluator.evaluate(query=user_query, response=actual_output,
-                                                                             contexts=retrieval_context)
-        context_relevancy_response = self.context_relevancy_evaluator.evaluate(query=user_query, response=actual_output,
-                                                                               contexts=retrieval_context)
-        logger.info(f"faithfulness_evaluation_response: {faithfulness_evaluation_response.score}")
-        logger.info(f"answer_relevancy_response: {answer_relevancy_response.score}")
-        logger.info(f"context_relevancy_response: {context_relevancy_response.score}")
+
+        if self.evaluation_mode != 'async':
+            self._score(user_query=user_query, actual_output=actual_output, retrieval_context=retrieval_context)
+            return
+
+        if random.random() >= self.sample_rate:
+            return
+        try:
+            self._queue.put_nowait((user_query, actual_output, retrieval_context))
+        except queue.Full:
+            logger.warning("evaluation queue is full, dropping the evaluation for this request")
+
+    def _drain_queue(self):
+        while True:
+            user_query, actual_output, retrieval_context = self._queue.get()
+            try:
+                self._score(user_query=user_query, actual_output=actual_output, retrieval_context=retrieval_context)
+            except Exception as e:
+                logger.error(f"Error while evaluating: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _score(self, user_query: str, actual_output: str, retrieval_context: List[str]) -> Dict[str, float]:
+        evaluators = {
+            'faithfulness': self.faithfulness_evaluator,
+            'answer_relevancy': self.answer_relevancy_evaluator,
+            'context_relevancy': self.context_relevancy_evaluator
+        }
+        if self.evaluation_mode == 'async':
+            futures = {name: self._executor.submit(evaluator.evaluate, query=user_query, response=actual_output,
+                                                   contexts=retrieval_context)
+                       for name, evaluator in evaluators.items()}
+            scores = {name: future.result().score for name, future in futures.items()}
+        else:
+            scores = {name: evaluator.evaluate(query=user_query, response=actual_output,
+                                               contexts=retrieval_context).score
+                      for name, evaluator in evaluators.items()}
+
+        for name, score in scores.items():
+            logger.info(f"{name}_response: {score}")
+        if self.sink_path:
+            record = {'timestamp': time.time(), 'query': user_query, 'response': actual_output, **scores}
+            with self._sink_lock, open(self.sink_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        return scores
@@ -128,3 +128,19 @@ class ReActWithQueryEngine:
             return response
         except Exception as e:
             logger.error(f'Error while generating response: {e}')
+
+    def query_stream(self, user_query: str) -> StreamingResponse:
+        agent_response = self.agent.stream_chat(message=user_query)
+        return StreamingResponse(response_gen=self._stream_with_evaluation(user_query, agent_response),
+                                 source_nodes=agent_response.source_nodes)
+
+    def _stream_with_evaluation(self, user_query: str, agent_response):
+        tokens = []
+        for token in agent_response.response_gen:
+            tokens.append(token)
+            yield token
+        # the answer is only complete once the stream is drained
+        if os.environ.get('IS_EVALUATION_NEEDED') == 'true':
+            self.rag_evaluator.evaluate(user_query=user_query,
+                                        response_obj=Response(response=''.join(tokens),
+                                                              source_nodes=agent_response.source_nodes))
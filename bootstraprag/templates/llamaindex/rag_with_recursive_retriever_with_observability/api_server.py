@@ -23,8 +23,25 @@ class RecursiveAgentsAPI(lit.LitAPI):
         return {'Agent': output}
 
 
+class RecursiveAgentsStreamingAPI(RecursiveAgentsAPI):
+    def predict(self, x, **kwargs):
+        streaming_response = self.agent_manager.query_stream(x)
+        for token in streaming_response.response_gen:
+            yield {'token': token}
+        # the retrieved context is sent once generation is finished
+        yield {'source_nodes': [{'text': node.get_content(), 'score': node.score, 'metadata': node.metadata}
+                                for node in streaming_response.source_nodes]}
+
+    def encode_response(self, output_stream, **kwargs):
+        for output in output_stream:
+            yield output
+
+
 if __name__ == "__main__":
-    lit_api = RecursiveAgentsAPI()
+    # stream tokens as they are generated instead of returning the full completion
+    is_streaming = os.environ.get('LIT_SERVER_STREAM') == 'true'
+    lit_api = RecursiveAgentsStreamingAPI() if is_streaming else RecursiveAgentsAPI()
     server = lit.LitServer(lit_api=lit_api, api_path='/api/v1/chat-completion',
-                           workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')))
+                           workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')),
+                           stream=is_streaming)
     server.run(port=os.environ.get('LIT_SERVER_PORT'))
@@ -35,6 +35,7 @@ class RecursiveAgentManager:
         self.document_data = {}
         self.agents = {}
         self.query_engine = None
+        self.streaming_query_engine = None
 
         # Initialize settings
         self._initialize_settings()
@@ -143,6 +144,12 @@ class RecursiveAgentManager:
             similarity_top_k=1,
             verbose=True
         )
+        # the selected agent still answers in full, only the final synthesis streams tokens
+        self.streaming_query_engine = vector_index.as_query_engine(
+            similarity_top_k=1,
+            verbose=True,
+            streaming=True
+        )
 
     def query(self, question: str) -> str:
         """
@@ -157,3 +164,17 @@ class RecursiveAgentManager:
         if self.query_engine is None:
             raise RuntimeError("Query engine not initialized")
         return self.query_engine.query(question)
+
+    def query_stream(self, question: str):
+        """
+        Query the agent system with a question, streaming the answer.
+
+        Args:
+            question (str): The question to ask
+
+        Returns:
+            StreamingResponse: Tokens of the answer as they are generated, plus the source nodes
+        """
+        if self.streaming_query_engine is None:
+            raise RuntimeError("Query engine not initialized")
+        return self.streaming_query_engine.query(question)
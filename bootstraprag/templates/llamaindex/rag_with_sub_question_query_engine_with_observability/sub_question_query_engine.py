@@ -2,7 +2,7 @@ from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageCon
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
 from llama_index.core.query_engine import SubQuestionQueryEngine
 from llama_index.core.callbacks import CallbackManager, LlamaDebugHandler
-from llama_index.core import Settings
+from llama_index.core import Settings, get_response_synthesizer
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
 from llama_index.vector_stores.qdrant import QdrantVectorStore
@@ -36,6 +36,7 @@ class SubQuestionQueryEngineAgent:
 
         # Initialize query engine
         self.query_engine = None
+        self.streaming_query_engine = None
 
     def _setup_settings(self):
         """Configure LlamaIndex settings"""
@@ -89,6 +90,11 @@ class SubQuestionQueryEngineAgent:
         self.query_engine = SubQuestionQueryEngine.from_defaults(
             query_engine_tools=query_engine_tools
         )
+        # sub questions are still answered in full, only the final synthesis streams tokens
+        self.streaming_query_engine = SubQuestionQueryEngine.from_defaults(
+            query_engine_tools=query_engine_tools,
+            response_synthesizer=get_response_synthesizer(streaming=True)
+        )
 
     def query(self, question: str):
         """Execute a query and return the response"""
@@ -96,3 +102,10 @@ class SubQuestionQueryEngineAgent:
             raise ValueError("Query engine not initialized. Call load_and_index_documents first.")
 
         return self.query_engine.query(question)
+
+    def query_stream(self, question: str):
+        """Execute a query and return a StreamingResponse of the final answer"""
+        if self.streaming_query_engine is None:
+            raise ValueError("Query engine not initialized. Call load_and_index_documents first.")
+
+        return self.streaming_query_engine.query(question)
@@ -17,15 +17,43 @@ class SimpleRAGServingAPI(ls.LitAPI, ABC):
     def decode_request(self, request, **kwargs):
         return request["query"]
 
-    def predict(self, query: str):
+    def batch(self, inputs):
+        return list(inputs)
+
+    def predict(self, query):
+        # with dynamic batching enabled litserve hands over all queries collected within the batch timeout
+        if isinstance(query, list):
+            return self.simpleRAG.do_rag_batch(user_queries=query)
         return self.simpleRAG.do_rag(user_query=query)
 
+    def unbatch(self, output):
+        return list(output)
+
     def encode_response(self, output, **kwargs):
         return {'response': output}
 
 
+class SimpleRAGStreamingAPI(SimpleRAGServingAPI):
+    def predict(self, query: str):
+        streaming_response = self.simpleRAG.do_rag_stream(user_query=query)
+        for token in streaming_response.response_gen:
+            yield {'token': token}
+        # the retrieved context is sent once generation is finished
+        yield {'source_nodes': [{'text': node.get_content(), 'score': node.score, 'metadata': node.metadata}
+                                for node in streaming_response.source_nodes]}
+
+    def encode_response(self, output_stream, **kwargs):
+        for output in output_stream:
+            yield output
+
+
 if __name__ == '__main__':
-    api = SimpleRAGServingAPI()
+    # stream tokens as they are generated instead of returning the full completion
+    is_streaming = os.environ.get('LIT_SERVER_STREAM') == 'true'
+    api = SimpleRAGStreamingAPI() if is_streaming else SimpleRAGServingAPI()
     server = ls.LitServer(lit_api=api, api_path='/api/v1/chat-completion',
-                          workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')))
+                          workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')),
+                          stream=is_streaming,
+                          max_batch_size=1 if is_streaming else int(os.environ.get('LIT_SERVER_MAX_BATCH_SIZE', 1)),
+                          batch_timeout=float(os.environ.get('LIT_SERVER_BATCH_TIMEOUT', 0.0)))
     server.run(port=os.environ.get('LIT_SERVER_PORT'))
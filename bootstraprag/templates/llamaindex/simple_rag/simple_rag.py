@@ -9,11 +9,18 @@ from llama_index.vector_stores.qdrant import QdrantVectorStore
 from llama_index.core.agent import ReActAgent
 from llama_index.llms.ollama import Ollama
 from llama_index.core.base.response.schema import Response, StreamingResponse, AsyncStreamingResponse, PydanticResponse
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.async_utils import asyncio_run
 from dotenv import load_dotenv, find_dotenv
 from rag_evaluator import RAGEvaluator
-from typing import Union
+from qdrant_client.http.models import PointIdsList, QueryRequest
+from collections import OrderedDict
+from typing import Dict, List, Union
 import qdrant_client
+import asyncio
+import hashlib
 import logging
+import json
 import os
 
 _ = load_dotenv(find_dotenv())
@@ -28,12 +35,24 @@ class SimpleRAG:
     ]
 
     def __init__(self, input_dir: str, similarity_top_k: int = 3, chunk_size: int = 128, chunk_overlap: int = 100,
-                 show_progress: bool = False):
+                 show_progress: bool = False, incremental: bool = None, manifest_path: str = None,
+                 response_mode: str = 'compact', node_postprocessors: list = None, max_cached_engines: int = 8,
+                 max_concurrent_llm_calls: int = 4):
         self.index_loaded = False
         self.similarity_top_k = similarity_top_k
         self.input_dir = input_dir
+        # incremental ingestion keeps a manifest of file hashes -> chunk ids so that only changed files are embedded
+        self.incremental = incremental if incremental is not None else \
+            os.environ.get('IS_INCREMENTAL_INGESTION_NEEDED') == 'true'
+        self.manifest_path = manifest_path or os.environ.get('INGESTION_MANIFEST_PATH', '.ingestion_manifest.json')
         self._index: VectorStoreIndex = None
         self._engine = None
+        # query engines are expensive to assemble, keep a small LRU of variants keyed by their parameters
+        self.response_mode = response_mode
+        self.node_postprocessors = node_postprocessors or []
+        self.max_cached_engines = max_cached_engines
+        self._query_engines: OrderedDict = OrderedDict()
+        self.max_concurrent_llm_calls = max_concurrent_llm_calls
         self.agent: ReActAgent = None
         self.query_engine_tools = []
         self.show_progress = show_progress
@@ -67,6 +86,10 @@ class SimpleRAG:
 
     def _create_index(self):
 
+        if self.incremental:
+            self._sync_index()
+            return
+
         if self.client.collection_exists(collection_name=os.environ['COLLECTION_NAME']):
             try:
                 self._index = VectorStoreIndex.from_vector_store(vector_store=self.vector_store)
@@ -85,13 +108,176 @@ class SimpleRAG:
                                                           storage_context=storage_context,
                                                           show_progress=self.show_progress)
 
-    def do_rag(self, user_query: str) -> RESPONSE_TYPE:
+    @staticmethod
+    def _file_hash(file_path: str, block_size: int = 1 << 20) -> str:
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def _load_manifest(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r') as f:
+            manifest = json.load(f)
+        # a manifest written for another collection does not describe what is stored in this one
+        if manifest.get('collection_name') != os.environ['COLLECTION_NAME']:
+            return {}
+        return manifest.get('files', {})
+
+    def _save_manifest(self, files: Dict[str, Dict]):
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'collection_name': os.environ['COLLECTION_NAME'], 'files': files}, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _sync_index(self):
+        collection_name = os.environ['COLLECTION_NAME']
+        # without the collection nothing recorded in the manifest is actually stored, so start over
+        manifest = self._load_manifest() if self.client.collection_exists(collection_name=collection_name) else {}
+        if not manifest and self.client.collection_exists(collection_name=collection_name) and \
+                self.client.count(collection_name=collection_name, exact=True).count > 0:
+            # chunks that no manifest tracks (index built without incremental ingestion, or a lost manifest)
+            # would be duplicated by re-inserting every file, so rebuild the collection from scratch instead
+            logger.warning(f"collection {collection_name} holds chunks not tracked by {self.manifest_path}, "
+                           f"rebuilding it from scratch")
+            self.client.delete_collection(collection_name=collection_name)
+            # the store cached that the collection existed, a fresh one recreates it on the first upsert
+            self.vector_store = QdrantVectorStore(client=self.client, collection_name=collection_name)
+            self._query_engines.clear()
+
+        input_files = [str(f) for f in SimpleDirectoryReader(input_dir=self.input_dir).input_files]
+        current_hashes = {file_path: self._file_hash(file_path) for file_path in input_files}
+
+        changed_files = [f for f, file_hash in current_hashes.items() if manifest.get(f, {}).get('hash') != file_hash]
+        stale_files = [f for f in manifest if f not in current_hashes or f in changed_files]
+        logger.info(f"incremental ingestion: {len(changed_files)} new/changed, "
+                    f"{len([f for f in manifest if f not in current_hashes])} removed, "
+                    f"{len(current_hashes) - len(changed_files)} unchanged files")
+
+        stale_node_ids = [node_id for f in stale_files for node_id in manifest[f]['node_ids']]
+        if stale_node_ids:
+            logger.info(f"deleting {len(stale_node_ids)} stale chunks")
+            self.client.delete(collection_name=collection_name, points_selector=PointIdsList(points=stale_node_ids))
+        for f in stale_files:
+            manifest.pop(f)
+
+        self._index = VectorStoreIndex.from_vector_store(vector_store=self.vector_store)
+
+        if changed_files:
+            _docs = SimpleDirectoryReader(input_files=changed_files).load_data(show_progress=self.show_progress)
+            nodes = Settings.node_parser.get_nodes_from_documents(_docs, show_progress=self.show_progress)
+            logger.info(f"indexing {len(nodes)} chunks from {len(changed_files)} files")
+            self._index.insert_nodes(nodes)
+
+            node_ids_by_file: Dict[str, list] = {f: [] for f in changed_files}
+            for node in nodes:
+                node_ids_by_file.setdefault(node.metadata.get('file_path'), []).append(node.node_id)
+            for f in changed_files:
+                manifest[f] = {'hash': current_hashes[f], 'node_ids': node_ids_by_file[f]}
+
+        self._save_manifest(manifest)
+        self.index_loaded = True
+
+    def _get_query_engine(self, similarity_top_k: int, response_mode: str, streaming: bool = False):
+        key = (similarity_top_k, response_mode, streaming, tuple(id(p) for p in self.node_postprocessors))
+        if key in self._query_engines:
+            self._query_engines.move_to_end(key)
+            return self._query_engines[key]
+
+        logger.info(f"building query engine for similarity_top_k={similarity_top_k}, response_mode={response_mode}, "
+                    f"streaming={streaming}")
+        query_engine = self._index.as_query_engine(similarity_top_k=similarity_top_k, response_mode=response_mode,
+                                                   node_postprocessors=self.node_postprocessors, streaming=streaming)
+        self._query_engines[key] = query_engine
+        if len(self._query_engines) > self.max_cached_engines:
+            self._query_engines.popitem(last=False)
+        return query_engine
+
+    def do_rag(self, user_query: str, similarity_top_k: int = None, response_mode: str = None) -> RESPONSE_TYPE:
 
         logger.info("retrieving the relavent nodes")
-        query_engine = self._index.as_query_engine(similarity_top_k=self.similarity_top_k)
+        query_engine = self._get_query_engine(similarity_top_k=similarity_top_k or self.similarity_top_k,
+                                              response_mode=response_mode or self.response_mode)
         logger.info("LLM is thinking...")
         response = query_engine.query(str_or_query_bundle=user_query)
         logger.info(f'response: {response}')
         if os.environ.get('IS_EVALUATION_NEEDED') == 'true':
             self.rag_evaluator.evaluate(user_query=user_query, response_obj=response)
         return response
+
+    def do_rag_stream(self, user_query: str, similarity_top_k: int = None,
+                      response_mode: str = None) -> StreamingResponse:
+
+        logger.info("retrieving the relavent nodes")
+        query_engine = self._get_query_engine(similarity_top_k=similarity_top_k or self.similarity_top_k,
+                                              response_mode=response_mode or self.response_mode, streaming=True)
+        logger.info("LLM is streaming...")
+        streaming_response = query_engine.query(str_or_query_bundle=user_query)
+        return StreamingResponse(response_gen=self._stream_with_evaluation(user_query, streaming_response),
+                                 source_nodes=streaming_response.source_nodes)
+
+    def _stream_with_evaluation(self, user_query: str, streaming_response: StreamingResponse):
+        tokens = []
+        for token in streaming_response.response_gen:
+            tokens.append(token)
+            yield token
+        # the answer is only complete once the stream is drained
+        if os.environ.get('IS_EVALUATION_NEEDED') == 'true':
+            self.rag_evaluator.evaluate(user_query=user_query,
+                                        response_obj=Response(response=''.join(tokens),
+                                                              source_nodes=streaming_response.source_nodes))
+
+    @staticmethod
+    def _format_queries(user_queries: List[str]) -> List[str]:
+        # the batch goes through the text embedding path, so apply the query instruction get_query_embedding would add
+        query_instruction = getattr(Settings.embed_model, 'query_instruction', None)
+        if not query_instruction:
+            return user_queries
+        return [f"{query_instruction.strip()} {user_query.strip()}" for user_query in user_queries]
+
+    def do_rag_batch(self, user_queries: List[str], similarity_top_k: int = None,
+                     response_mode: str = None) -> List[RESPONSE_TYPE]:
+        similarity_top_k = similarity_top_k or self.similarity_top_k
+        query_engine = self._get_query_engine(similarity_top_k=similarity_top_k,
+                                              response_mode=response_mode or self.response_mode)
+
+        logger.info(f"embedding {len(user_queries)} queries in one batch")
+        query_embeddings = Settings.embed_model.get_text_embedding_batch(self._format_queries(user_queries))
+
+        logger.info("retrieving the relavent nodes with one batch search")
+        search_results = self.client.query_batch_points(
+            collection_name=os.environ['COLLECTION_NAME'],
+            requests=[QueryRequest(query=query_embedding, limit=similarity_top_k, with_payload=True)
+                      for query_embedding in query_embeddings]
+        )
+
+        query_bundles = []
+        retrieved_nodes = []
+        for user_query, query_embedding, search_result in zip(user_queries, query_embeddings, search_results):
+            query_bundle = QueryBundle(query_str=user_query, embedding=query_embedding)
+            result = self.vector_store.parse_to_query_result(search_result.points)
+            nodes = [NodeWithScore(node=node, score=score) for node, score in zip(result.nodes, result.similarities)]
+            for node_postprocessor in self.node_postprocessors:
+                nodes = node_postprocessor.postprocess_nodes(nodes, query_bundle=query_bundle)
+            query_bundles.append(query_bundle)
+            retrieved_nodes.append(nodes)
+
+        async def _synthesize_all():
+            # bound the number of generations running against the LLM at the same time
+            semaphore = asyncio.Semaphore(self.max_concurrent_llm_calls)
+
+            async def _synthesize(query_bundle, nodes):
+                async with semaphore:
+                    return await query_engine.asynthesize(query_bundle=query_bundle, nodes=nodes)
+
+            return await asyncio.gather(*[_synthesize(query_bundle, nodes)
+                                          for query_bundle, nodes in zip(query_bundles, retrieved_nodes)])
+
+        logger.info("LLM is thinking...")
+        responses = asyncio_run(_synthesize_all())
+        if os.environ.get('IS_EVALUATION_NEEDED') == 'true':
+            for user_query, response in zip(user_queries, responses):
+                self.rag_evaluator.evaluate(user_query=user_query, response_obj=response)
+        return responses
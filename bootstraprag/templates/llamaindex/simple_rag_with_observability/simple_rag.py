@@ -98,3 +98,23 @@ class SimpleRAG:
         if os.environ.get('IS_EVALUATION_NEEDED') == 'true':
             self.rag_evaluator.evaluate(user_query=user_query, response_obj=response)
         return response
+
+    def do_rag_stream(self, user_query: str) -> StreamingResponse:
+
+        logger.info("retrieving the relavent nodes")
+        query_engine = self._index.as_query_engine(similarity_top_k=self.similarity_top_k, streaming=True)
+        logger.info("LLM is streaming...")
+        streaming_response = query_engine.query(str_or_query_bundle=user_query)
+        return StreamingResponse(response_gen=self._stream_with_evaluation(user_query, streaming_response),
+                                 source_nodes=streaming_response.source_nodes)
+
+    def _stream_with_evaluation(self, user_query: str, streaming_response: StreamingResponse):
+        tokens = []
+        for token in streaming_response.response_gen:
+            tokens.append(token)
+            yield token
+        # the answer is only complete once the stream is drained
+        if os.environ.get('IS_EVALUATION_NEEDED') == 'true':
+            self.rag_evaluator.evaluate(user_query=user_query,
+                                        response_obj=Response(response=''.join(tokens),
+                                                              source_nodes=streaming_response.source_nodes))
@@ -9,6 +9,8 @@ simple_search = HybridSearch(collection_name=os.environ['COLLECTION_NAME'])
 
 # uncomment if you want to index the data for the first time
 # simple_search.insert()
+# large files are streamed, use parallel embedding workers to speed them up
+# simple_search.insert(payload_path='data/startups.json', batch_size=256, parallel=0)
 result = simple_search.search(input_text='San Francisco')
 
 print(result)
\ No newline at end of file
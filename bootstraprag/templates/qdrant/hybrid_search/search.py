@@ -1,5 +1,6 @@
 import os
 import json
+from typing import Dict, Iterator, List, Optional, Tuple
 from tqdm import tqdm
 from qdrant_client import qdrant_client, models
 from dotenv import find_dotenv, load_dotenv
@@ -20,9 +21,6 @@ class HybridSearch:
         self.distance = distance
         self.collection_name = collection_name
 
-        self.documents = []
-        self.metadata = []
-
         # create collection call
         self._create_collection(collection_name=collection_name)
 
@@ -34,25 +32,38 @@ class HybridSearch:
                 sparse_vectors_config=self.client.get_fastembed_sparse_vector_params()
             )
 
-    def _read_data(self):
-        payload_path = "data/startups-mini.json"
-
+    @staticmethod
+    def _read_data(payload_path: str, chunk_size: int) -> Iterator[Tuple[List[str], List[Dict]]]:
+        # the file is read chunk_size lines at a time, so memory is bounded by one chunk
+        documents, metadata = [], []
         with open(payload_path) as fd:
             for line in fd:
                 obj = json.loads(line)
-                self.documents.append(obj.pop("description"))
-                self.metadata.append(obj)
+                documents.append(obj.pop("description"))
+                metadata.append(obj)
+                if len(documents) == chunk_size:
+                    yield documents, metadata
+                    documents, metadata = [], []
+        if documents:
+            yield documents, metadata
 
-    def insert(self) -> UpdateResult:
-        self._read_data()
+    def insert(self, payload_path: str = "data/startups-mini.json", batch_size: int = 128,
+               parallel: Optional[int] = None, chunk_size: int = 4096) -> UpdateResult:
         # simple boilerplate code adjust it accordingly
-        self.client.add(
-            collection_name=self.collection_name,
-            documents=self.documents,
-            metadata=self.metadata,
-            # batch_size=128,  # a batch os 128 embeddings will be pushed in a single request
-            ids=tqdm(range(len(self.documents)))
-        )
+        offset = 0
+        with tqdm() as progress:
+            for documents, metadata in self._read_data(payload_path, chunk_size=chunk_size):
+                # add() can read the documents more than once (e.g. for dense and sparse embeddings), so it gets lists
+                self.client.add(
+                    collection_name=self.collection_name,
+                    documents=documents,
+                    metadata=metadata,
+                    batch_size=batch_size,  # a batch of batch_size embeddings will be pushed in a single request
+                    parallel=parallel,  # number of fastembed worker processes, 0 uses all cores, None embeds in-process
+                    ids=range(offset, offset + len(documents))
+                )
+                offset += len(documents)
+                progress.update(len(documents))
 
     def search(self, input_text: str) -> QueryResponse:
         search_result = self.client.query(
@@ -1,5 +1,11 @@
 import os
+import json
+import math
 import tqdm
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple
 from qdrant_client import QdrantClient, models
 from fastembed.embedding import TextEmbedding
 from fastembed.sparse.sparse_text_embedding import SparseTextEmbedding
@@ -9,9 +15,16 @@ from datasets import load_dataset
 
 _ = load_dotenv(find_dotenv())
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DENSE_VECTOR_NAME = "all-MiniLM-L6-v2"
+LATE_INTERACTION_VECTOR_NAME = "colbertv2.0"
+
 
 class AdvancedHybridSearch:
-    def __init__(self, collection_name: str):
+    def __init__(self, collection_name: str, quantization: Dict[str, str] = None, on_disk: Dict[str, bool] = None,
+                 rescore: Dict[str, bool] = None, oversampling: Dict[str, float] = None):
         self.dense_embedding_model = TextEmbedding(model_name=os.environ.get("DENSE_MODEL"))
         self.sparse_embedding_model = SparseTextEmbedding(model_name=os.environ.get("SPARSE_MODEL"))
         self.late_interaction_embedding_model = LateInteractionTextEmbedding(os.environ.get("LATE_INTERACTION_MODEL"))
@@ -19,38 +32,164 @@ class AdvancedHybridSearch:
         self.client = QdrantClient(url=os.environ['DB_URL'], api_key=os.environ['DB_API_KEY'])
 
         self.collection_name = collection_name
-        self.dense_embeddings = None
-        self.sparse_embeddings = None
-        self.late_interaction_embeddings = None
+        self.dense_dimension = None
+        self.late_interaction_dimension = None
         self.dataset = None
 
+        # per named vector storage: 'scalar' (int8) or 'binary' quantization and keeping the originals on disk
+        self.quantization = quantization or {
+            DENSE_VECTOR_NAME: os.environ.get("DENSE_QUANTIZATION", "none"),
+            LATE_INTERACTION_VECTOR_NAME: os.environ.get("LATE_INTERACTION_QUANTIZATION", "none"),
+        }
+        self.on_disk = on_disk or {
+            DENSE_VECTOR_NAME: os.environ.get("DENSE_ON_DISK", "false") == "true",
+            LATE_INTERACTION_VECTOR_NAME: os.environ.get("LATE_INTERACTION_ON_DISK", "false") == "true",
+        }
+        self.rescore = rescore or {
+            DENSE_VECTOR_NAME: os.environ.get("DENSE_QUANTIZATION_RESCORE", "true") == "true",
+            LATE_INTERACTION_VECTOR_NAME: os.environ.get("LATE_INTERACTION_QUANTIZATION_RESCORE", "true") == "true",
+        }
+        self.oversampling = oversampling or {
+            DENSE_VECTOR_NAME: float(os.environ.get("DENSE_QUANTIZATION_OVERSAMPLING", 2.0)),
+            LATE_INTERACTION_VECTOR_NAME: float(os.environ.get("LATE_INTERACTION_QUANTIZATION_OVERSAMPLING", 2.0)),
+        }
+        self.search_params = self._search_params(quantized={
+            name: self.quantization.get(name, "none") != "none"
+            for name in (DENSE_VECTOR_NAME, LATE_INTERACTION_VECTOR_NAME)
+        })
+
         self._create_collection()
 
+    def _search_params(self, quantized: Dict[str, bool]) -> Dict[str, models.SearchParams]:
+        # quantized vectors are searched first, then the oversampled candidates are rescored with the originals
+        return {
+            name: models.SearchParams(
+                quantization=models.QuantizationSearchParams(rescore=self.rescore.get(name, True),
+                                                             oversampling=self.oversampling.get(name, 2.0))
+            ) if is_quantized else None
+            for name, is_quantized in quantized.items()
+        }
+
+    @staticmethod
+    def _model_dimension(embedding_model, model_name: str, manifest_path: str) -> int:
+        # 1. fastembed ships the output dimension in its model descriptions
+        for description in embedding_model.list_supported_models():
+            if description["model"].lower() == model_name.lower():
+                return description["dim"]
+
+        # 2. custom models: reuse a dimension probed by a previous run
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+        if model_name in manifest:
+            return manifest[model_name]
+
+        # 3. last resort: embed a single probe string, never the dataset
+        probe = next(iter(embedding_model.embed(["dimension probe"])))
+        manifest[model_name] = int(probe.shape[-1])
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest[model_name]
+
     def _get_dimensions(self):
-        self.dataset = load_dataset("BeIR/scifact", 'corpus', split="corpus")
-        self.dense_embeddings = list(self.dense_embedding_model.passage_embed(self.dataset["text"][0:1]))
-        self.sparse_embeddings = list(self.sparse_embedding_model.passage_embed(self.dataset["text"][0:1]))
-        self.late_interaction_embeddings = list(
-            self.late_interaction_embedding_model.passage_embed(self.dataset["text"][0:1]))
+        manifest_path = os.environ.get("EMBEDDING_DIMENSIONS_MANIFEST", ".embedding_dimensions.json")
+        self.dense_dimension = self._model_dimension(self.dense_embedding_model,
+                                                     os.environ.get("DENSE_MODEL"), manifest_path)
+        self.late_interaction_dimension = self._model_dimension(self.late_interaction_embedding_model,
+                                                                os.environ.get("LATE_INTERACTION_MODEL"),
+                                                                manifest_path)
 
-    def _create_collection(self):
+    def _load_dataset(self):
+        # only ingestion needs the corpus, query serving never touches it
+        if self.dataset is None:
+            self.dataset = load_dataset("BeIR/scifact", 'corpus', split="corpus")
+        return self.dataset
+
+    @staticmethod
+    def _quantization_config(quantization: str):
+        if quantization == "scalar":
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True
+                )
+            )
+        if quantization == "binary":
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(
+                    always_ram=True
+                )
+            )
+        return None
+
+    def _collection_vectors(self) -> Dict[str, models.VectorParams]:
+        return self.client.get_collection(collection_name=self.collection_name).config.params.vectors
+
+    def _vector_storage_diff(self, vectors: Dict[str, models.VectorParams]) -> Dict[str, models.VectorParamsDiff]:
+        vectors_diff = {}
+        for name in (DENSE_VECTOR_NAME, LATE_INTERACTION_VECTOR_NAME):
+            quantization_config = self._quantization_config(self.quantization.get(name))
+            on_disk = self.on_disk.get(name, False)
+            if vectors[name].quantization_config == quantization_config and bool(vectors[name].on_disk) == on_disk:
+                continue
+            vectors_diff[name] = models.VectorParamsDiff(
+                quantization_config=quantization_config or models.Disabled.DISABLED,
+                on_disk=on_disk
+            )
+        return vectors_diff
+
+    def _use_existing_vector_storage(self):
+        # an existing collection is never changed implicitly, searches follow the storage it actually has
+        vectors = self._collection_vectors()
+        self.search_params = self._search_params(quantized={
+            name: vectors[name].quantization_config is not None
+            for name in (DENSE_VECTOR_NAME, LATE_INTERACTION_VECTOR_NAME)
+        })
+        vectors_diff = self._vector_storage_diff(vectors)
+        if vectors_diff:
+            logger.warning(f"quantization/on disk storage of {list(vectors_diff)} in {self.collection_name} differs "
+                           f"from the configured one, call apply_storage_config() to update the collection")
+
+    def apply_storage_config(self):
+        """
+        Apply the configured quantization and on disk settings to an existing collection.
+        Changing them makes qdrant re-optimize the collection, so this is only done on request.
+        """
+        vectors_diff = self._vector_storage_diff(self._collection_vectors())
+        if vectors_diff:
+            logger.info(f"updating quantization/on disk storage of {list(vectors_diff)} in {self.collection_name}")
+            self.client.update_collection(collection_name=self.collection_name, vectors_config=vectors_diff)
+        self.search_params = self._search_params(quantized={
+            name: self.quantization.get(name, "none") != "none"
+            for name in (DENSE_VECTOR_NAME, LATE_INTERACTION_VECTOR_NAME)
+        })
 
-        self._get_dimensions()
+    def _create_collection(self):
 
-        if not self.client.collection_exists(collection_name=self.collection_name):
+        if self.client.collection_exists(collection_name=self.collection_name):
+            self._use_existing_vector_storage()
+        else:
+            self._get_dimensions()
             self.client.create_collection(
                 collection_name=self.collection_name,
                 vectors_config={
-                    "all-MiniLM-L6-v2": models.VectorParams(
-                        size=len(self.dense_embeddings[0]),
-                        distance=models.Distance.COSINE
+                    DENSE_VECTOR_NAME: models.VectorParams(
+                        size=self.dense_dimension,
+                        distance=models.Distance.COSINE,
+                        on_disk=self.on_disk.get(DENSE_VECTOR_NAME, False),
+                        quantization_config=self._quantization_config(self.quantization.get(DENSE_VECTOR_NAME))
                     ),
-                    "colbertv2.0": models.VectorParams(
-                        size=len(self.late_interaction_embeddings[0][0]),
+                    LATE_INTERACTION_VECTOR_NAME: models.VectorParams(
+                        size=self.late_interaction_dimension,
                         distance=models.Distance.COSINE,
                         multivector_config=models.MultiVectorConfig(
                             comparator=models.MultiVectorComparator.MAX_SIM
-                        )
+                        ),
+                        on_disk=self.on_disk.get(LATE_INTERACTION_VECTOR_NAME, False),
+                        quantization_config=self._quantization_config(
+                            self.quantization.get(LATE_INTERACTION_VECTOR_NAME))
                     )
                 },
                 sparse_vectors_config={
@@ -60,32 +199,62 @@ class AdvancedHybridSearch:
                 }
             )
 
-    def insert_data(self):
-        batch_size = 4
-        for batch in tqdm.tqdm(self.dataset.iter(batch_size=batch_size), total=len(self.dataset) // batch_size):
-            dense_embeddings = list(self.dense_embedding_model.passage_embed(batch["text"]))
-            sparse_embeddings = list(self.sparse_embedding_model.passage_embed(batch["text"]))
-            late_interaction_embeddings = list(self.late_interaction_embedding_model.passage_embed(batch["text"]))
+    def _embed_passages(self, encoder_pool: ThreadPoolExecutor, texts: List[str]) -> Tuple[Future, Future, Future]:
+        # the three encoders are independent, run them side by side
+        return (
+            encoder_pool.submit(lambda: list(self.dense_embedding_model.passage_embed(texts, batch_size=len(texts)))),
+            encoder_pool.submit(lambda: list(self.sparse_embedding_model.passage_embed(texts, batch_size=len(texts)))),
+            encoder_pool.submit(
+                lambda: list(self.late_interaction_embedding_model.passage_embed(texts, batch_size=len(texts))))
+        )
 
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=[
-                    models.PointStruct(
-                        id=int(batch["_id"][i]),
-                        vector={
-                            "all-MiniLM-L6-v2": dense_embeddings[i].tolist(),
-                            "splade-PP-en-v1": sparse_embeddings[i].as_object(),
-                            "colbertv2.0": late_interaction_embeddings[i].tolist(),
-                        },
-                        payload={
-                            "_id": batch["_id"][i],
-                            "title": batch["title"][i],
-                            "text": batch["text"][i],
-                        }
-                    )
-                    for i, _ in enumerate(batch["_id"])
-                ]
+    def _upsert_batch(self, upsert_pool: ThreadPoolExecutor, in_flight: deque, max_in_flight_upserts: int,
+                      batch: Dict[str, List], embedding_futures: Tuple[Future, Future, Future], wait: bool = False):
+        dense_embeddings, sparse_embeddings, late_interaction_embeddings = [f.result() for f in embedding_futures]
+        points = [
+            models.PointStruct(
+                id=int(batch["_id"][i]),
+                vector={
+                    "all-MiniLM-L6-v2": dense_embeddings[i].tolist(),
+                    "splade-PP-en-v1": sparse_embeddings[i].as_object(),
+                    "colbertv2.0": late_interaction_embeddings[i].tolist(),
+                },
+                payload={
+                    "_id": batch["_id"][i],
+                    "title": batch["title"][i],
+                    "text": batch["text"][i],
+                }
             )
+            for i, _ in enumerate(batch["_id"])
+        ]
+        if wait:
+            # barrier: once every earlier request is acknowledged, a blocking upsert returns only after qdrant has
+            # applied all of them, so the data is searchable when insert_data returns
+            while in_flight:
+                in_flight.popleft().result()
+            self.client.upsert(collection_name=self.collection_name, points=points, wait=True)
+            return
+        # bound the number of outstanding upsert requests, surfacing any failure of the oldest one
+        while len(in_flight) >= max_in_flight_upserts:
+            in_flight.popleft().result()
+        in_flight.append(upsert_pool.submit(self.client.upsert, collection_name=self.collection_name,
+                                            points=points, wait=False))
+
+    def insert_data(self, batch_size: int = 32, max_in_flight_upserts: int = 4):
+        # pipeline: while batch N is being upserted, batch N+1 is already being embedded
+        in_flight = deque()
+        previous = None
+        with ThreadPoolExecutor(max_workers=3) as encoder_pool, \
+                ThreadPoolExecutor(max_workers=max_in_flight_upserts) as upsert_pool:
+            dataset = self._load_dataset()
+            for batch in tqdm.tqdm(dataset.iter(batch_size=batch_size),
+                                   total=math.ceil(len(dataset) / batch_size)):
+                current = (batch, self._embed_passages(encoder_pool, batch["text"]))
+                if previous is not None:
+                    self._upsert_batch(upsert_pool, in_flight, max_in_flight_upserts, *previous)
+                previous = current
+            if previous is not None:
+                self._upsert_batch(upsert_pool, in_flight, max_in_flight_upserts, *previous, wait=True)
 
     def query_with_dense_embedding(self, query_text: str):
         query_vector = next(self.dense_embedding_model.embed(query_text)).tolist()
@@ -93,6 +262,7 @@ class AdvancedHybridSearch:
             collection_name=self.collection_name,
             query=query_vector,
             using="all-MiniLM-L6-v2",
+            search_params=self.search_params[DENSE_VECTOR_NAME],
             with_payload=False,
             limit=10,
         )
@@ -115,35 +285,158 @@ class AdvancedHybridSearch:
             collection_name=self.collection_name,
             query=query_vector,
             using="colbertv2.0",
+            search_params=self.search_params[LATE_INTERACTION_VECTOR_NAME],
             with_payload=False,
             limit=10,
         )
         return results
 
-    def query_with_rrf(self, query_text: str):
-        dense_query_vector = next(self.dense_embedding_model.embed(query_text)).tolist()
-        sparse_query_vector = next(self.sparse_embedding_model.embed(query_text))
-
-        prefetch = [
+    def _hybrid_prefetch(self, dense_query_vector, sparse_query_vector, limit: int) -> List[models.Prefetch]:
+        # dense and sparse candidate lists shared by every rrf and multi stage query, single or batched
+        return [
             models.Prefetch(
                 query=dense_query_vector,
                 using="all-MiniLM-L6-v2",
-                limit=20,
+                params=self.search_params[DENSE_VECTOR_NAME],
+                limit=limit,
             ),
             models.Prefetch(
                 query=models.SparseVector(**sparse_query_vector.as_object()),
                 using="splade-PP-en-v1",
-                limit=20,
+                limit=limit,
             ),
         ]
 
+    def _fused_prefetch(self, dense_query_vector, sparse_query_vector, prefetch_limit: int,
+                        fusion_limit: int) -> models.Prefetch:
+        # stage 1: dense and sparse candidates, stage 2: RRF fusion of both lists
+        return models.Prefetch(
+            prefetch=self._hybrid_prefetch(dense_query_vector, sparse_query_vector, limit=prefetch_limit),
+            query=models.FusionQuery(
+                fusion=models.Fusion.RRF
+            ),
+            limit=fusion_limit,
+        )
+
+    def query_with_rrf(self, query_text: str, prefetch_limit: int = 20, limit: int = 10):
+        dense_query_vector = next(self.dense_embedding_model.embed(query_text)).tolist()
+        sparse_query_vector = next(self.sparse_embedding_model.embed(query_text))
+
         results = self.client.query_points(
             collection_name=self.collection_name,
-            prefetch=prefetch,
+            prefetch=self._hybrid_prefetch(dense_query_vector, sparse_query_vector, limit=prefetch_limit),
             query=models.FusionQuery(
                 fusion=models.Fusion.RRF
             ),
             with_payload=False,
-            limit=10,
+            limit=limit,
+        )
+        return results
+
+    def query_with_multi_stage(self, query_text: str, prefetch_limit: int = 50, fusion_limit: int = 20,
+                               limit: int = 10):
+        dense_query_vector = next(self.dense_embedding_model.embed(query_text)).tolist()
+        sparse_query_vector = next(self.sparse_embedding_model.embed(query_text))
+        late_interaction_query_vector = next(self.late_interaction_embedding_model.embed(query_text)).tolist()
+
+        # stage 3: ColBERT only re-scores the fused top candidates instead of the whole collection
+        results = self.client.query_points(
+            collection_name=self.collection_name,
+            prefetch=self._fused_prefetch(dense_query_vector, sparse_query_vector, prefetch_limit=prefetch_limit,
+                                          fusion_limit=fusion_limit),
+            query=late_interaction_query_vector,
+            using="colbertv2.0",
+            search_params=self.search_params[LATE_INTERACTION_VECTOR_NAME],
+            with_payload=False,
+            limit=limit,
+        )
+        return results
+
+    # batch variants: one encoder call per model and a single query_batch_points round trip for all queries
+    def query_batch_with_dense_embedding(self, query_texts: List[str], limit: int = 10):
+        query_vectors = [vector.tolist() for vector in self.dense_embedding_model.embed(query_texts)]
+        return self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=query_vector,
+                    using="all-MiniLM-L6-v2",
+                    params=self.search_params[DENSE_VECTOR_NAME],
+                    with_payload=False,
+                    limit=limit,
+                )
+                for query_vector in query_vectors
+            ]
+        )
+
+    def query_batch_with_sparse_embedding(self, query_texts: List[str], limit: int = 10):
+        query_vectors = list(self.sparse_embedding_model.embed(query_texts))
+        return self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=models.SparseVector(**query_vector.as_object()),
+                    using="splade-PP-en-v1",
+                    with_payload=False,
+                    limit=limit,
+                )
+                for query_vector in query_vectors
+            ]
+        )
+
+    def query_batch_with_late_interaction_embedding(self, query_texts: List[str], limit: int = 10):
+        query_vectors = [vector.tolist() for vector in self.late_interaction_embedding_model.embed(query_texts)]
+        return self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=query_vector,
+                    using="colbertv2.0",
+                    params=self.search_params[LATE_INTERACTION_VECTOR_NAME],
+                    with_payload=False,
+                    limit=limit,
+                )
+                for query_vector in query_vectors
+            ]
+        )
+
+    def query_batch_with_rrf(self, query_texts: List[str], prefetch_limit: int = 20, limit: int = 10):
+        dense_query_vectors = [vector.tolist() for vector in self.dense_embedding_model.embed(query_texts)]
+        sparse_query_vectors = list(self.sparse_embedding_model.embed(query_texts))
+        return self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                models.QueryRequest(
+                    prefetch=self._hybrid_prefetch(dense_query_vector, sparse_query_vector, limit=prefetch_limit),
+                    query=models.FusionQuery(
+                        fusion=models.Fusion.RRF
+                    ),
+                    with_payload=False,
+                    limit=limit,
+                )
+                for dense_query_vector, sparse_query_vector in zip(dense_query_vectors, sparse_query_vectors)
+            ]
+        )
+
+    def query_batch_with_multi_stage(self, query_texts: List[str], prefetch_limit: int = 50, fusion_limit: int = 20,
+                                     limit: int = 10):
+        dense_query_vectors = [vector.tolist() for vector in self.dense_embedding_model.embed(query_texts)]
+        sparse_query_vectors = list(self.sparse_embedding_model.embed(query_texts))
+        late_interaction_query_vectors = [vector.tolist()
+                                          for vector in self.late_interaction_embedding_model.embed(query_texts)]
+        return self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                models.QueryRequest(
+                    prefetch=self._fused_prefetch(dense_query_vector, sparse_query_vector,
+                                                  prefetch_limit=prefetch_limit, fusion_limit=fusion_limit),
+                    query=late_interaction_query_vector,
+                    using="colbertv2.0",
+                    params=self.search_params[LATE_INTERACTION_VECTOR_NAME],
+                    with_payload=False,
+                    limit=limit,
+                )
+                for dense_query_vector, sparse_query_vector, late_interaction_query_vector in zip(
+                    dense_query_vectors, sparse_query_vectors, late_interaction_query_vectors)
+            ]
         )
-        return results
\ No newline at end of file
@@ -0,0 +1,102 @@
+import os
+import time
+import requests
+import numpy as np
+from datasets import load_dataset
+from qdrant_client import models
+from dotenv import load_dotenv, find_dotenv
+from advanced_hybrid_search import AdvancedHybridSearch, DENSE_VECTOR_NAME, LATE_INTERACTION_VECTOR_NAME
+
+_ = load_dotenv(find_dotenv())
+
+# (label, quantization per named vector, on_disk per named vector)
+CONFIGURATIONS = [
+    ("float32", {DENSE_VECTOR_NAME: "none", LATE_INTERACTION_VECTOR_NAME: "none"},
+     {DENSE_VECTOR_NAME: False, LATE_INTERACTION_VECTOR_NAME: False}),
+    ("scalar", {DENSE_VECTOR_NAME: "scalar", LATE_INTERACTION_VECTOR_NAME: "scalar"},
+     {DENSE_VECTOR_NAME: False, LATE_INTERACTION_VECTOR_NAME: False}),
+    ("scalar-on-disk", {DENSE_VECTOR_NAME: "scalar", LATE_INTERACTION_VECTOR_NAME: "scalar"},
+     {DENSE_VECTOR_NAME: True, LATE_INTERACTION_VECTOR_NAME: True}),
+    ("binary-on-disk", {DENSE_VECTOR_NAME: "binary", LATE_INTERACTION_VECTOR_NAME: "binary"},
+     {DENSE_VECTOR_NAME: True, LATE_INTERACTION_VECTOR_NAME: True}),
+]
+
+
+def collection_memory(collection_name: str):
+    # segment level ram/disk usage is only exposed through the telemetry endpoint
+    response = requests.get(f"{os.environ['DB_URL']}/telemetry", params={"details_level": 3},
+                            headers={"api-key": os.environ['DB_API_KEY']})
+    collections = response.json().get("result", {}).get("collections", {}).get("collections", [])
+    ram_bytes, disk_bytes = 0, 0
+    for collection in collections:
+        if collection.get("id") != collection_name:
+            continue
+        for shard in collection.get("shards", []):
+            for segment in (shard.get("local") or {}).get("segments", []):
+                ram_bytes += segment.get("info", {}).get("ram_usage_bytes", 0)
+                disk_bytes += segment.get("info", {}).get("disk_usage_bytes", 0)
+    return ram_bytes, disk_bytes
+
+
+def wait_until_indexed(adv_search: AdvancedHybridSearch):
+    while adv_search.client.get_collection(adv_search.collection_name).status != models.CollectionStatus.GREEN:
+        time.sleep(1)
+
+
+def exact_ids(adv_search: AdvancedHybridSearch, query_vector, using: str, limit: int):
+    return {point.id for point in adv_search.client.query_points(
+        collection_name=adv_search.collection_name,
+        query=query_vector,
+        using=using,
+        search_params=models.SearchParams(exact=True),
+        with_payload=False,
+        limit=limit,
+    ).points}
+
+
+def run_benchmark(base_collection_name: str, num_queries: int = 100, limit: int = 10):
+    queries = load_dataset("BeIR/scifact", "queries", split="queries")["text"][:num_queries]
+    ground_truth = None
+    report = []
+    for label, quantization, on_disk in CONFIGURATIONS:
+        adv_search = AdvancedHybridSearch(collection_name=f"{base_collection_name}-{label}",
+                                          quantization=quantization, on_disk=on_disk)
+        adv_search.insert_data()
+        wait_until_indexed(adv_search)
+
+        if ground_truth is None:
+            # the full precision collection is benchmarked first, its exact search is the reference for recall
+            ground_truth = {
+                name: [exact_ids(adv_search, vector, using=name, limit=limit) for vector in vectors]
+                for name, vectors in (
+                    (DENSE_VECTOR_NAME, [v.tolist() for v in adv_search.dense_embedding_model.embed(queries)]),
+                    (LATE_INTERACTION_VECTOR_NAME,
+                     [v.tolist() for v in adv_search.late_interaction_embedding_model.embed(queries)]),
+                )
+            }
+
+        row = {"config": label}
+        row["ram_mb"], row["disk_mb"] = [b / 1024 ** 2 for b in collection_memory(adv_search.collection_name)]
+        for name, query_func in ((DENSE_VECTOR_NAME, adv_search.query_with_dense_embedding),
+                                 (LATE_INTERACTION_VECTOR_NAME, adv_search.query_with_late_interaction_embedding)):
+            latencies, recalls = [], []
+            # latency includes query encoding, which costs the same for every configuration
+            for query_text, expected_ids in zip(queries, ground_truth[name]):
+                start = time.perf_counter()
+                points = query_func(query_text=query_text).points
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(len({point.id for point in points} & expected_ids) / limit)
+            row[f"{name} p50_ms"] = float(np.percentile(latencies, 50))
+            row[f"{name} p99_ms"] = float(np.percentile(latencies, 99))
+            row[f"{name} recall@{limit}"] = float(np.mean(recalls))
+        report.append(row)
+
+    columns = list(report[0].keys())
+    print(" | ".join(columns))
+    for row in report:
+        print(" | ".join(row["config"] if column == "config" else f"{row[column]:.3f}" for column in columns))
+    return report
+
+
+if __name__ == '__main__':
+    run_benchmark(base_collection_name=os.environ.get('COLLECTION_NAME'))
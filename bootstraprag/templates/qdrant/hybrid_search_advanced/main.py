@@ -6,7 +6,9 @@ from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv())
 
 adv_search = AdvancedHybridSearch(collection_name=os.environ.get('COLLECTION_NAME'))
-# adv_search.insert_data()
+# adv_search.insert_data(batch_size=32, max_in_flight_upserts=4)
+# apply changed quantization/on disk settings from .env to the existing collection, triggers a re-optimization
+# adv_search.apply_storage_config()
 
 query_text = "What is the impact of COVID-19 on the environment?"
 results = adv_search.query_with_dense_embedding(query_text=query_text)
@@ -20,3 +22,12 @@ print(results)
 
 results = adv_search.query_with_rrf(query_text=query_text)
 print(results)
+
+results = adv_search.query_with_multi_stage(query_text=query_text, prefetch_limit=50, fusion_limit=20, limit=10)
+print(results)
+
+# batch variants send every query in a single request
+query_texts = [query_text, "How does air pollution affect respiratory health?"]
+batch_results = adv_search.query_batch_with_multi_stage(query_texts=query_texts)
+for query, result in zip(query_texts, batch_results):
+    print(query, result.points)
@@ -0,0 +1,72 @@
+import time
+import asyncio
+from typing import Callable, Optional
+
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+from qdrant_client.conversions.common_types import CollectionInfo
+
+ProgressCallback = Callable[[CollectionInfo], None]
+
+
+def print_progress(collection_info: CollectionInfo):
+    indexed = collection_info.indexed_vectors_count or 0
+    total = collection_info.points_count or 0
+    print(f"status={collection_info.status}, indexed {indexed}/{total} vectors")
+
+
+def _next_delay(delay: float, max_delay: float, backoff: float) -> float:
+    return min(delay * backoff, max_delay)
+
+
+def wait_for_index(client: QdrantClient, collection_name: str, timeout: float = 600, initial_delay: float = 0.1,
+                   max_delay: float = 5.0, backoff: float = 2.0,
+                   on_progress: Optional[ProgressCallback] = print_progress) -> CollectionInfo:
+    """Poll until the collection is GREEN, backing off exponentially so the indexing server is not flooded."""
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        collection_info = client.get_collection(collection_name=collection_name)
+        if on_progress:
+            on_progress(collection_info)
+        # Collection status is green, which means the indexing is finished
+        if collection_info.status == models.CollectionStatus.GREEN:
+            return collection_info
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"collection {collection_name} was not indexed within {timeout} seconds")
+        time.sleep(delay)
+        delay = _next_delay(delay, max_delay, backoff)
+
+
+def wait_for_rebuild_to_start(client: QdrantClient, collection_name: str, indexed_vectors_count: int,
+                              timeout: float = 10, initial_delay: float = 0.05, max_delay: float = 1.0,
+                              backoff: float = 2.0) -> bool:
+    """Poll until the optimizer picked up a config change, i.e. the status left GREEN or indexed vectors dropped."""
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        collection_info = client.get_collection(collection_name=collection_name)
+        if collection_info.status != models.CollectionStatus.GREEN or \
+                (collection_info.indexed_vectors_count or 0) < indexed_vectors_count:
+            return True
+        if time.monotonic() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = _next_delay(delay, max_delay, backoff)
+
+
+async def async_wait_for_index(client: AsyncQdrantClient, collection_name: str, timeout: float = 600,
+                               initial_delay: float = 0.1, max_delay: float = 5.0, backoff: float = 2.0,
+                               on_progress: Optional[ProgressCallback] = print_progress) -> CollectionInfo:
+    """Async variant of wait_for_index."""
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        collection_info = await client.get_collection(collection_name=collection_name)
+        if on_progress:
+            on_progress(collection_info)
+        if collection_info.status == models.CollectionStatus.GREEN:
+            return collection_info
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"collection {collection_name} was not indexed within {timeout} seconds")
+        await asyncio.sleep(delay)
+        delay = _next_delay(delay, max_delay, backoff)
@@ -1,12 +1,21 @@
 from measure_retrieval_quality import MeasureRetrievalQuality
 
+# streaming=True uploads the train split straight from the dataset stream in batches
 measure_rq = MeasureRetrievalQuality(collection_name='arxiv-titles-instructorxl-embeddings',
-                                     dataset_path='Qdrant/arxiv-titles-instructorxl-embeddings')
+                                     dataset_path='Qdrant/arxiv-titles-instructorxl-embeddings',
+                                     streaming=True, train_size=10000, test_size=1000,
+                                     upload_batch_size=256, upload_parallel=2, payload_fields=['title'])
 
 # before tuning
 print(f"avg(precision@5) = {measure_rq.compute_avg_precision_at_k(k=5)}")
+# same measurement with batched, concurrent requests plus recall, latency percentiles come from unbatched queries
+print(measure_rq.compute_metrics_at_k(k=5, batch_size=100, max_concurrent_batches=4))
 
-measure_rq.tune_hnsw_configs()
+# sweep m / ef_construct / hnsw_ef, the report marks the pareto optimal configurations
+report = measure_rq.tune_hnsw_configs(m_values=(16, 32), ef_construct_values=(100, 200),
+                                      hnsw_ef_values=(64, 128, 256), k=5, report_path="hnsw_sweep_report.md")
+for row in report:
+    print(row)
 
 # after tuning
 print(f"avg(precision@5) = {measure_rq.compute_avg_precision_at_k(k=5)}")
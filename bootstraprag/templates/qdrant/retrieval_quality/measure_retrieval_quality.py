@@ -1,26 +1,105 @@
 import os
+import time
+import asyncio
+import itertools
+from typing import Dict, Iterator, List, Sequence
 
+import requests
+
+import numpy as np
 from datasets import load_dataset
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 from qdrant_client.conversions.common_types import CollectionInfo
 from dotenv import load_dotenv, find_dotenv
+from index_utils import wait_for_index, wait_for_rebuild_to_start
+
+
+class LocalGroundTruth:
+    """Exact cosine top-k over the train vectors computed locally, so ground truth puts no load on qdrant."""
+
+    def __init__(self, size: int, memmap_path: str = None):
+        # items may come from a stream, so the matrix is preallocated for `size` rows on the first add
+        self.size = size
+        self.memmap_path = memmap_path
+        self.matrix = None
+        self.ids = None
+        self._ids = []
+
+    def add(self, item: Dict):
+        vector = np.asarray(item["vector"], dtype=np.float32)
+        if self.matrix is None:
+            if self.memmap_path:
+                # large sets stay on disk and are paged in by the OS during the matrix multiply
+                self.matrix = np.lib.format.open_memmap(self.memmap_path, mode="w+", dtype=np.float32,
+                                                        shape=(self.size, len(vector)))
+            else:
+                self.matrix = np.empty((self.size, len(vector)), dtype=np.float32)
+        self.matrix[len(self._ids)] = vector / np.linalg.norm(vector)
+        self._ids.append(item["id"])
+
+    def finalize(self) -> "LocalGroundTruth":
+        self.ids = np.array(self._ids)
+        self.matrix = self.matrix[:len(self._ids)]
+        return self
+
+    def top_k(self, query_vectors, k: int, batch_size: int = 256):
+        query_matrix = np.asarray(query_vectors, dtype=np.float32)
+        query_matrix = query_matrix / np.linalg.norm(query_matrix, axis=1, keepdims=True)
+        results = []
+        for start in range(0, len(query_matrix), batch_size):
+            scores = query_matrix[start:start + batch_size] @ self.matrix.T
+            # argpartition finds the k best in linear time, only those k are sorted
+            top_k = np.argpartition(-scores, kth=k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(scores, top_k, axis=1), axis=1)
+            results.extend(self.ids[np.take_along_axis(top_k, order, axis=1)].tolist())
+        return results
 
 
 class MeasureRetrievalQuality:
-    def __init__(self, dataset_path: str, collection_name: str, streaming: bool = True):
+    def __init__(self, dataset_path: str, collection_name: str, streaming: bool = True,
+                 ground_truth_memmap_path: str = None, train_size: int = 10000, test_size: int = 1000,
+                 upload_batch_size: int = 256, upload_parallel: int = 1, payload_fields: Sequence[str] = None):
         _ = load_dotenv(find_dotenv())
         # path = "Qdrant/arxiv-titles-instructorxl-embeddings"
-        dataset = load_dataset(
-            path=dataset_path, split="train", streaming=True,
-            token=os.environ.get('HF_TOKEN')
-        )
+        self.dataset_path = dataset_path
         self.collection_name = collection_name or os.environ.get('COLLECTION_NAME')
-        dataset_iterator = iter(dataset)
-        self.train_dataset = [next(dataset_iterator) for _ in range(10000)]
-        self.test_dataset = [next(dataset_iterator) for _ in range(1000)]
+        self.train_size = train_size
+        self.test_size = test_size
+        self.upload_batch_size = upload_batch_size
+        self.upload_parallel = upload_parallel
+        # only these item fields are stored as payload, the evaluation itself needs none
+        self.payload_fields = payload_fields or []
+        # the dataset is read once: train items first, the test items follow them in the same iterator
+        self._dataset_iterator = iter(self._load_stream())
+        if streaming:
+            # train items are streamed straight into qdrant, only the small test set is kept in memory
+            self.train_dataset = None
+            self.test_dataset = None
+        else:
+            self.train_dataset = list(itertools.islice(self._dataset_iterator, train_size))
+            self.test_dataset = list(itertools.islice(self._dataset_iterator, test_size))
         self.client = QdrantClient(url=os.environ.get('DB_URL'), api_key=os.environ.get('DB_API_KEY'))
+        self.ground_truth_memmap_path = ground_truth_memmap_path or os.environ.get('GROUND_TRUTH_MEMMAP_PATH')
+        # filled while the train items are uploaded
+        self.local_ground_truth: LocalGroundTruth = None
 
         self._upset_and_index()
+        if streaming:
+            self.test_dataset = list(itertools.islice(self._dataset_iterator, test_size))
+
+    def _load_stream(self):
+        return load_dataset(
+            path=self.dataset_path, split="train", streaming=True,
+            token=os.environ.get('HF_TOKEN')
+        )
+
+    def _iter_train_items(self, ground_truth: LocalGroundTruth) -> Iterator[Dict]:
+        train_items = self.train_dataset if self.train_dataset is not None else \
+            itertools.islice(self._dataset_iterator, self.train_size)
+        for item in train_items:
+            # the local ground truth is filled on the way to qdrant, so the train split is never read twice
+            ground_truth.add(item)
+            yield item
 
     def _upset_and_index(self):
 
@@ -33,23 +112,24 @@ class MeasureRetrievalQuality:
                 )
             )
 
+        ground_truth = LocalGroundTruth(size=self.train_size, memmap_path=self.ground_truth_memmap_path)
         self.client.upload_points(  # upload_points is available as of qdrant-client v1.7.1
             collection_name=self.collection_name,
-            points=[
+            # a generator keeps peak memory flat, upload_points consumes it in batches
+            points=(
                 models.PointStruct(
                     id=item["id"],
                     vector=item["vector"],
-                    payload=item,
+                    payload={field: item[field] for field in self.payload_fields if field in item},
                 )
-                for item in self.train_dataset
-            ]
+                for item in self._iter_train_items(ground_truth)
+            ),
+            batch_size=self.upload_batch_size,
+            parallel=self.upload_parallel
         )
+        self.local_ground_truth = ground_truth.finalize()
 
-        # Collection status is green, which means the indexing is finished
-        while True:
-            collection_info = self.client.get_collection(collection_name=self.collection_name)
-            if collection_info.status == models.CollectionStatus.GREEN:
-                break
+        self._wait_for_green()
 
     def compute_avg_precision_at_k(self, k: int):
         precisions = []
@@ -77,18 +157,157 @@ class MeasureRetrievalQuality:
 
         return sum(precisions) / len(precisions)
 
-    def tune_hnsw_configs(self):
-        # Tweaking the HNSW parameters
-        self.client.update_collection(
-            collection_name=self.collection_name,
-            hnsw_config=models.HnswConfigDiff(
-                m=32,  # Increase the number of edges per node from the default 16 to 32
-                ef_construct=200,  # Increase the number of neighbours from the default 100 to 200
+    async def _evaluate_chunk(self, async_client: AsyncQdrantClient, semaphore: asyncio.Semaphore, items, k: int,
+                              local_ground_truth: bool, hnsw_ef: int = None):
+        search_params = models.SearchParams(hnsw_ef=hnsw_ef) if hnsw_ef else None
+        async with semaphore:
+            ann_responses = await async_client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=[models.QueryRequest(query=item["vector"], limit=k, params=search_params) for item in items]
             )
+
+            if local_ground_truth:
+                knn_ids_per_item = await asyncio.to_thread(self.local_ground_truth.top_k,
+                                                           [item["vector"] for item in items], k)
+            else:
+                knn_responses = await async_client.query_batch_points(
+                    collection_name=self.collection_name,
+                    requests=[
+                        models.QueryRequest(query=item["vector"], limit=k, params=models.SearchParams(exact=True))
+                        for item in items
+                    ]
+                )
+                knn_ids_per_item = [[point.id for point in knn_response.points] for knn_response in knn_responses]
+
+        results = []
+        for ann_response, knn_ids in zip(ann_responses, knn_ids_per_item):
+            ann_ids = set(point.id for point in ann_response.points)
+            knn_ids = set(knn_ids)
+            hits = len(ann_ids.intersection(knn_ids))
+            results.append((hits / max(len(ann_ids), 1), hits / max(len(knn_ids), 1)))
+        return results
+
+    async def _compute_metrics_at_k(self, k: int, batch_size: int, max_concurrent_batches: int,
+                                    local_ground_truth: bool, hnsw_ef: int = None):
+        async_client = AsyncQdrantClient(url=os.environ.get('DB_URL'), api_key=os.environ.get('DB_API_KEY'))
+        semaphore = asyncio.Semaphore(max_concurrent_batches)
+        try:
+            chunks = [self.test_dataset[i:i + batch_size] for i in range(0, len(self.test_dataset), batch_size)]
+            chunk_results = await asyncio.gather(
+                *[self._evaluate_chunk(async_client, semaphore, chunk, k, local_ground_truth, hnsw_ef)
+                  for chunk in chunks]
+            )
+        finally:
+            await async_client.close()
+        return [result for chunk_result in chunk_results for result in chunk_result]
+
+    def _sample_query_latencies_ms(self, k: int, sample_size: int, hnsw_ef: int = None) -> np.ndarray:
+        # batched requests share one round trip, so per query latency is timed with a separate, sequential pass
+        search_params = models.SearchParams(hnsw_ef=hnsw_ef) if hnsw_ef else None
+        latencies_ms = []
+        for item in self.test_dataset[:sample_size]:
+            start = time.perf_counter()
+            self.client.query_points(collection_name=self.collection_name, query=item["vector"], limit=k,
+                                     search_params=search_params, with_payload=False)
+            latencies_ms.append((time.perf_counter() - start) * 1000)
+        return np.array(latencies_ms)
+
+    def compute_metrics_at_k(self, k: int, batch_size: int = 100, max_concurrent_batches: int = 4,
+                             local_ground_truth: bool = True, hnsw_ef: int = None, latency_sample_size: int = 200):
+        # by default the exact neighbours come from LocalGroundTruth instead of exact=True searches on the server
+        results = np.array(asyncio.run(
+            self._compute_metrics_at_k(k, batch_size, max_concurrent_batches, local_ground_truth, hnsw_ef)))
+        latencies_ms = self._sample_query_latencies_ms(k, latency_sample_size, hnsw_ef)
+        return {
+            f"precision@{k}": float(results[:, 0].mean()),
+            f"recall@{k}": float(results[:, 1].mean()),
+            "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+            "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+            "latency_p99_ms": float(np.percentile(latencies_ms, 99)),
+        }
+
+    def _wait_for_green(self) -> CollectionInfo:
+        # backoff polling instead of hammering the server that is busy indexing
+        return wait_for_index(self.client, collection_name=self.collection_name,
+                              timeout=float(os.environ.get('INDEX_WAIT_TIMEOUT', 600)))
+
+    def _collection_ram_bytes(self) -> int:
+        # segment level ram usage is only exposed through the telemetry endpoint
+        response = requests.get(f"{os.environ.get('DB_URL')}/telemetry", params={"details_level": 3},
+                                headers={"api-key": os.environ.get('DB_API_KEY')})
+        collections = response.json().get("result", {}).get("collections", {}).get("collections", [])
+        return sum(
+            segment.get("info", {}).get("ram_usage_bytes", 0)
+            for collection in collections if collection.get("id") == self.collection_name
+            for shard in collection.get("shards", [])
+            for segment in (shard.get("local") or {}).get("segments", [])
         )
 
-        # Collection status is green, which means the indexing is finished
-        while True:
-            collection_info = self.client.get_collection(collection_name=self.collection_name)
-            if collection_info.status == models.CollectionStatus.GREEN:
-                break
\ No newline at end of file
+    @staticmethod
+    def _mark_pareto_optimal(report: List[Dict], precision_key: str):
+        # a configuration is pareto optimal when no other one is at least as good on precision, p99 latency and
+        # memory while being strictly better on one of them
+        for row in report:
+            row["pareto_optimal"] = not any(
+                other[precision_key] >= row[precision_key]
+                and other["latency_p99_ms"] <= row["latency_p99_ms"]
+                and other["ram_mb"] <= row["ram_mb"]
+                and (other[precision_key] > row[precision_key]
+                     or other["latency_p99_ms"] < row["latency_p99_ms"]
+                     or other["ram_mb"] < row["ram_mb"])
+                for other in report
+            )
+        return report
+
+    def tune_hnsw_configs(self, m_values: Sequence[int] = (16, 32), ef_construct_values: Sequence[int] = (100, 200),
+                          hnsw_ef_values: Sequence[int] = (64, 128, 256), k: int = 5,
+                          report_path: str = "hnsw_sweep_report.md") -> List[Dict]:
+        precision_key = f"precision@{k}"
+        report = []
+        for m, ef_construct in itertools.product(m_values, ef_construct_values):
+            # Tweaking the HNSW parameters rebuilds the index of the collection
+            indexed_vectors_count = self.client.get_collection(
+                collection_name=self.collection_name).indexed_vectors_count or 0
+            start = time.perf_counter()
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                hnsw_config=models.HnswConfigDiff(
+                    m=m,  # number of edges per node, default 16
+                    ef_construct=ef_construct,  # number of neighbours considered while building, default 100
+                )
+            )
+            # the collection can still report GREEN until the optimizer picks the change up, waiting for GREEN
+            # straight away would time a rebuild that has not started yet
+            rebuild_observed = wait_for_rebuild_to_start(self.client, collection_name=self.collection_name,
+                                                         indexed_vectors_count=indexed_vectors_count)
+            if not rebuild_observed:
+                print(f"no index rebuild observed for m={m}, ef_construct={ef_construct}, "
+                      f"indexing_s only covers the config update")
+            self._wait_for_green()
+            indexing_seconds = time.perf_counter() - start
+            ram_mb = self._collection_ram_bytes() / 1024 ** 2
+
+            for hnsw_ef in hnsw_ef_values:
+                metrics = self.compute_metrics_at_k(k=k, hnsw_ef=hnsw_ef)
+                report.append({
+                    "m": m,
+                    "ef_construct": ef_construct,
+                    "hnsw_ef": hnsw_ef,
+                    "indexing_s": indexing_seconds,
+                    "rebuild_observed": rebuild_observed,
+                    "ram_mb": ram_mb,
+                    "latency_p50_ms": metrics["latency_p50_ms"],
+                    "latency_p99_ms": metrics["latency_p99_ms"],
+                    precision_key: metrics[precision_key],
+                })
+
+        self._mark_pareto_optimal(report, precision_key)
+        columns = list(report[0].keys())
+        with open(report_path, "w") as f:
+            f.write("| " + " | ".join(columns) + " |\n")
+            f.write("|" + "---|" * len(columns) + "\n")
+            for row in report:
+                f.write("| " + " | ".join(
+                    f"{row[column]:.3f}" if isinstance(row[column], float) else str(row[column]) for column in columns
+                ) + " |\n")
+        return report
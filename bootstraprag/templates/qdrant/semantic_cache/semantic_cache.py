@@ -1,23 +1,91 @@
 import uuid
 import os
+import fcntl
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+import numpy as np
 from dotenv import load_dotenv, find_dotenv
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import PointStruct, SearchParams, VectorParams, Distance
+from qdrant_client.http.models import (PointStruct, SearchParams, VectorParams, Distance, Filter, FieldCondition,
+                                       Range, FilterSelector, PointIdsList, OrderBy, PayloadSchemaType,
+                                       IsEmptyCondition, PayloadField)
 from sentence_transformers import SentenceTransformer
 from llama_index.llms.ollama import Ollama
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """Bounded in-process LRU with a per-entry TTL, used as the exact-match tier in front of Qdrant."""
+
+    def __init__(self, max_size=1024, ttl_seconds=300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
 
 class SemanticCache:
-    def __init__(self, threshold=0.35):
+    def __init__(self, threshold=0.35, l1_max_size=None, l1_ttl_seconds=None, ttl_seconds=None, max_size=None,
+                 sweep_interval_seconds=None, lock_dir=None, lock_stripes=None):
         # load the data from env
         load_dotenv(find_dotenv())
 
+        # L1: exact match on the normalized query, checked before the query is encoded
+        self.local_cache = LocalCache(
+            max_size=l1_max_size or int(os.environ.get('L1_CACHE_MAX_SIZE', 1024)),
+            ttl_seconds=l1_ttl_seconds or float(os.environ.get('L1_CACHE_TTL_SECONDS', 300))
+        )
+
         self.encoder = SentenceTransformer(model_name_or_path=os.environ.get('model_name_or_path'))
         self.cache_client = QdrantClient(url=os.environ.get('QDRANT_URL'), api_key=os.environ.get('QDRANT_API_KEY'))
         self.cache_collection_name = "cache"
         self.threshold = threshold
 
+        # single-flight: misses that match an in-flight computation wait for it instead of calling the LLM again
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        # litserve workers are separate processes, a miss is also serialized across them with a file lock per
+        # normalized query, hashed onto a fixed number of lock files so they do not pile up
+        self.lock_dir = lock_dir or os.environ.get('CACHE_LOCK_DIR') or \
+            os.path.join(tempfile.gettempdir(), 'semantic_cache_locks')
+        self.lock_stripes = lock_stripes or int(os.environ.get('CACHE_LOCK_STRIPES', 1024))
+        os.makedirs(self.lock_dir, exist_ok=True)
+        # invalidate() bumps a generation counter shared through the lock dir, every worker drops its L1 on a change
+        self._generation_path = os.path.join(self.lock_dir, "generation")
+        self._local_generation = self._read_generation()
+
         # Create the cache collection
         if not self.cache_client.collection_exists(collection_name=self.cache_collection_name):
             self.cache_client.create_collection(
@@ -27,41 +95,190 @@ class SemanticCache:
                     distance=Distance.COSINE
                 )
             )
+        # eviction filters and orders on these fields, so they have to be indexed
+        self.cache_client.create_payload_index(collection_name=self.cache_collection_name,
+                                               field_name="created_at", field_schema=PayloadSchemaType.FLOAT)
+        self.cache_client.create_payload_index(collection_name=self.cache_collection_name,
+                                               field_name="last_accessed_at", field_schema=PayloadSchemaType.FLOAT)
+        self.cache_client.create_payload_index(collection_name=self.cache_collection_name,
+                                               field_name="hit_count", field_schema=PayloadSchemaType.INTEGER)
+        self._backfill_timestamps()
+
+        # L2 eviction: entries expire after ttl_seconds, least recently used entries are dropped beyond max_size
+        self.ttl_seconds = ttl_seconds or float(os.environ.get('CACHE_TTL_SECONDS', 86400))
+        self.max_size = max_size or int(os.environ.get('CACHE_MAX_SIZE', 100000))
+        self.sweep_interval_seconds = sweep_interval_seconds or float(os.environ.get('CACHE_SWEEP_INTERVAL_SECONDS', 60))
+        self._sweeper = threading.Thread(target=self._sweep_forever, daemon=True)
+        self._sweeper.start()
+
+    def _backfill_timestamps(self):
+        # entries written before eviction existed have no created_at, the ttl filter and the eviction range/order_by
+        # would skip them forever, so they start their lifetime now
+        now = time.time()
+        self.cache_client.set_payload(
+            collection_name=self.cache_collection_name,
+            payload={"created_at": now, "last_accessed_at": now, "hit_count": 0},
+            points=FilterSelector(filter=Filter(must=[IsEmptyCondition(is_empty=PayloadField(key="created_at"))]))
+        )
+
+    @staticmethod
+    def normalize_query(query):
+        return " ".join(query.lower().split())
 
     def get_embedding(self, text):
         return self.encoder.encode([text])[0]
 
-    def search_cache(self, query):
-        query_vector = self.get_embedding(query)
+    def search_cache(self, query, query_vector=None):
+        query_vector = self.get_embedding(query) if query_vector is None else query_vector
         search_result = self.cache_client.search(
             collection_name=self.cache_collection_name,
             query_vector=query_vector,
+            # expired entries may still be waiting for the sweeper, never serve them
+            query_filter=Filter(must=[FieldCondition(key="created_at",
+                                                     range=Range(gte=time.time() - self.ttl_seconds))]),
             limit=1,
             search_params=SearchParams(hnsw_ef=128)
         )
         if search_result and search_result[0].score > self.threshold:
-            return search_result[0].payload['response']
+            hit = search_result[0]
+            self.cache_client.set_payload(
+                collection_name=self.cache_collection_name,
+                payload={"last_accessed_at": time.time(), "hit_count": hit.payload.get("hit_count", 0) + 1},
+                points=[hit.id],
+                wait=False
+            )
+            return hit.payload['response']
         return None
 
-    def add_to_cache(self, query, response):
-        query_vector = self.get_embedding(query)
+    def add_to_cache(self, query, response, query_vector=None):
+        query_vector = self.get_embedding(query) if query_vector is None else query_vector
         point = PointStruct(
             id=str(uuid.uuid4()),
             vector=query_vector,
-            payload={"query": query, "response": response}
+            payload={"query": query, "response": response, "created_at": time.time(),
+                     "last_accessed_at": time.time(), "hit_count": 0}
         )
         self.cache_client.upsert(
             collection_name=self.cache_collection_name,
             points=[point]
         )
 
+    def invalidate(self, query_filter: Filter):
+        # L1 cannot evaluate qdrant filters, so it is dropped as a whole, in this and every other worker
+        self.cache_client.delete(collection_name=self.cache_collection_name,
+                                 points_selector=FilterSelector(filter=query_filter))
+        with open(f"{self._generation_path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                tmp_path = f"{self._generation_path}.{os.getpid()}"
+                with open(tmp_path, "w") as generation_file:
+                    generation_file.write(str(self._read_generation() + 1))
+                # readers see either the old or the new counter, never a partial write
+                os.replace(tmp_path, self._generation_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self._sync_local_cache()
+
+    def _read_generation(self):
+        try:
+            with open(self._generation_path) as generation_file:
+                return int(generation_file.read())
+        except FileNotFoundError:
+            return 0
+
+    def _sync_local_cache(self):
+        generation = self._read_generation()
+        if generation != self._local_generation:
+            self.local_cache.clear()
+            self._local_generation = generation
+        return generation
+
+    def _put_local(self, cache_key, response, generation):
+        # a response read before an invalidation must not be put back into L1 after it
+        if self._read_generation() == generation:
+            self.local_cache.put(cache_key, response)
+
+    def evict(self):
+        expired = Filter(must=[FieldCondition(key="created_at", range=Range(lt=time.time() - self.ttl_seconds))])
+        self.cache_client.delete(collection_name=self.cache_collection_name,
+                                 points_selector=FilterSelector(filter=expired))
+
+        overflow = self.cache_client.count(collection_name=self.cache_collection_name, exact=True).count - self.max_size
+        if overflow > 0:
+            least_recently_used, _ = self.cache_client.scroll(
+                collection_name=self.cache_collection_name,
+                limit=overflow,
+                order_by=OrderBy(key="last_accessed_at", direction="asc"),
+                with_payload=False,
+                with_vectors=False
+            )
+            self.cache_client.delete(collection_name=self.cache_collection_name,
+                                     points_selector=PointIdsList(points=[point.id for point in least_recently_used]))
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval_seconds)
+            try:
+                self.evict()
+            except Exception as e:
+                logger.error(f"Exception while evicting cache entries: {e}")
+
     def get_response(self, query, compute_response_func):
-        cached_response = self.search_cache(query)
+        cache_key = self.normalize_query(query)
+        generation = self._sync_local_cache()
+        cached_response = self.local_cache.get(cache_key)
+        if cached_response:
+            return cached_response
+        # L2: semantic match in qdrant, promoted into L1 on a hit
+        query_vector = self.get_embedding(query)
+        cached_response = self.search_cache(query, query_vector=query_vector)
         if cached_response:
+            self._put_local(cache_key, cached_response, generation)
             return cached_response
-        _response = compute_response_func(query)
-        self.add_to_cache(query, _response)
-        return _response
+
+        in_flight, is_leader = self._join_in_flight(cache_key, query_vector)
+        if not is_leader:
+            return in_flight.result()
+        try:
+            with self._process_lock(cache_key):
+                # a previous leader, in this or another worker, may have filled the cache while we waited
+                _response = self.local_cache.get(cache_key) or self.search_cache(query, query_vector=query_vector)
+                if not _response:
+                    _response = compute_response_func(query)
+                    # upsert waits for the write, so the next lock holder finds it in qdrant
+                    self.add_to_cache(query, _response, query_vector=query_vector)
+                self._put_local(cache_key, _response, generation)
+            in_flight.set_result(_response)
+            return _response
+        except Exception as e:
+            in_flight.set_exception(e)
+            raise
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.pop(cache_key, None)
+
+    @contextmanager
+    def _process_lock(self, cache_key):
+        stripe = int(hashlib.sha256(cache_key.encode("utf-8")).hexdigest(), 16) % self.lock_stripes
+        with open(os.path.join(self.lock_dir, f"{stripe}.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _join_in_flight(self, cache_key, query_vector):
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / np.linalg.norm(query_vector)
+        with self._in_flight_lock:
+            if cache_key in self._in_flight:
+                return self._in_flight[cache_key][0], False
+            for in_flight, in_flight_vector in self._in_flight.values():
+                if float(np.dot(query_vector, in_flight_vector)) > self.threshold:
+                    return in_flight, False
+            in_flight = Future()
+            self._in_flight[cache_key] = (in_flight, query_vector)
+            return in_flight, True
 
 
 # Example usage
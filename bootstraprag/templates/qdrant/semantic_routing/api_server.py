@@ -41,17 +41,36 @@ class SemanticRoutingAPI(ls.LitAPI, ABC):
         self.semantic_routing_core.setup_routes(self.routes)
 
     def decode_request(self, request, **kwargs):
-        return request['question']
+        # a request carries either a single 'question' or a list of 'questions'
+        if 'questions' in request:
+            return list(request['questions']), True
+        return [request['question']], False
 
-    def predict(self, query, **kwargs):
-        return self.semantic_routing_core.route_query(query=query)
+    def batch(self, inputs):
+        return list(inputs)
+
+    def predict(self, inputs, **kwargs):
+        # with dynamic batching enabled litserve hands over all requests collected within the batch timeout
+        requests = inputs if isinstance(inputs, list) else [inputs]
+        queries = [query for questions, _ in requests for query in questions]
+        routes = iter(self.semantic_routing_core.route_queries(queries=queries))
+        outputs = [([next(routes) for _ in questions], is_list) for questions, is_list in requests]
+        return outputs if isinstance(inputs, list) else outputs[0]
+
+    def unbatch(self, output):
+        return list(output)
 
     def encode_response(self, output, **kwargs):
-        return {'response': output}
+        routes, is_list = output
+        if is_list:
+            return {'responses': routes}
+        return {'response': routes[0]}
 
 
 if __name__ == '__main__':
     api = SemanticRoutingAPI()
     server = ls.LitServer(lit_api=api, api_path='/api/v1/chat-completion',
-                          workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')))
+                          workers_per_device=int(os.environ.get('LIT_SERVER_WORKERS_PER_DEVICE')),
+                          max_batch_size=int(os.environ.get('LIT_SERVER_MAX_BATCH_SIZE', 1)),
+                          batch_timeout=float(os.environ.get('LIT_SERVER_BATCH_TIMEOUT', 0.0)))
     server.run(port=os.environ.get('LIT_SERVER_PORT'))
@@ -42,4 +42,8 @@ if __name__ == "__main__":
 
     for query in queries:
         routed_route = semantic_router.route_query(query)
+        print(f"Query: '{query}' routed to: '{routed_route}'")
+
+    # route the whole batch with one encoder call
+    for query, routed_route in zip(queries, semantic_router.route_queries(queries)):
         print(f"Query: '{query}' routed to: '{routed_route}'")
\ No newline at end of file
@@ -0,0 +1,81 @@
+import os
+import json
+import fcntl
+import hashlib
+from contextlib import contextmanager
+from typing import Callable, List, Sequence
+import numpy as np
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def routes_fingerprint(route_names: Sequence[str], utterances: Sequence[str]) -> str:
+    return _hash("\n".join(sorted(f"{name}\t{utterance}" for name, utterance in zip(route_names, utterances))))
+
+
+class RouteEmbeddingCache:
+    """
+    Route utterance embeddings persisted on local disk and shared by every worker process.
+
+    Each encoder model gets an `.npy` matrix plus a JSON manifest that maps utterance hashes to matrix rows
+    and records which route sets have already been pushed to which index.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        file_stem = os.path.join(cache_dir, _hash(model_name)[:16])
+        self.model_name = model_name
+        self.embeddings_path = f"{file_stem}.npy"
+        self.manifest_path = f"{file_stem}.json"
+        self.lock_path = f"{file_stem}.lock"
+
+    @contextmanager
+    def lock(self):
+        # workers start at the same time, only one of them should encode and sync, the rest reuse its work
+        with open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        if not (os.path.exists(self.manifest_path) and os.path.exists(self.embeddings_path)):
+            return {"model_name": self.model_name, "utterance_hashes": [], "synced_indexes": {}}, None
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        return manifest, np.load(self.embeddings_path)
+
+    def _save(self, manifest, embeddings: np.ndarray):
+        # write to temp files first so a crashed worker never leaves a half written cache behind
+        with open(f"{self.embeddings_path}.tmp", "wb") as f:
+            np.save(f, embeddings)
+        with open(f"{self.manifest_path}.tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(f"{self.embeddings_path}.tmp", self.embeddings_path)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+    def get_or_encode(self, utterances: List[str], encode: Callable[[List[str]], List[List[float]]]) -> np.ndarray:
+        """Return one embedding row per utterance, encoding only the ones not seen before."""
+        manifest, embeddings = self._load()
+        rows = {utterance_hash: row for row, utterance_hash in enumerate(manifest["utterance_hashes"])}
+        missing = list(dict.fromkeys(utterance for utterance in utterances if _hash(utterance) not in rows))
+        if missing:
+            new_embeddings = np.asarray(encode(missing), dtype=np.float32)
+            embeddings = new_embeddings if embeddings is None else np.vstack([embeddings, new_embeddings])
+            for utterance in missing:
+                rows[_hash(utterance)] = len(manifest["utterance_hashes"])
+                manifest["utterance_hashes"].append(_hash(utterance))
+            self._save(manifest, embeddings)
+        return embeddings[[rows[_hash(utterance)] for utterance in utterances]]
+
+    def is_synced(self, index_name: str, fingerprint: str) -> bool:
+        manifest, _ = self._load()
+        return manifest["synced_indexes"].get(index_name) == fingerprint
+
+    def mark_synced(self, index_name: str, fingerprint: str):
+        manifest, embeddings = self._load()
+        manifest["synced_indexes"][index_name] = fingerprint
+        self._save(manifest, embeddings)
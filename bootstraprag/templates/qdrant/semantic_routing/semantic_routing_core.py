@@ -1,17 +1,28 @@
 import os
+from collections import defaultdict
+import numpy as np
 from semantic_router import RouteLayer
 from semantic_router.encoders import FastEmbedEncoder
 from semantic_router.index import QdrantIndex
+from qdrant_client import models
+from route_embedding_cache import RouteEmbeddingCache, routes_fingerprint
 from dotenv import load_dotenv, find_dotenv
 
 # load the data from env file
 load_dotenv(find_dotenv())
 
+# payload keys QdrantIndex stores the route name and utterance under
+ROUTE_PAYLOAD_KEY = "sr_route"
+UTTERANCE_PAYLOAD_KEY = "sr_utterance"
+
 
 class SemanticRouter:
     def __init__(self, qdrant_api_key: str = os.environ.get('qdrant_api_key'),
                  qdrant_url: str = os.environ.get('qdrant_url'),
-                 index_name="semantic-router-index"):
+                 index_name="semantic-router-index",
+                 route_index_mode: str = os.environ.get('route_index_mode', 'remote'),
+                 top_k: int = 5,
+                 embedding_cache_dir: str = os.environ.get('route_embedding_cache_dir')):
         """
         Initialize the SemanticRouter with OpenAI API key and Qdrant configurations.
 
@@ -19,10 +30,22 @@ class SemanticRouter:
         :param qdrant_url: URL of the Qdrant instance.
         :param index_name: Name of the Qdrant index to use.
         :param location: None not to consider the in memory instance.
+        :param route_index_mode: 'remote' queries Qdrant per decision, 'local' keeps a NumPy copy of the index.
+        :param top_k: Number of nearest utterances considered by the local index.
+        :param embedding_cache_dir: Directory for route embeddings shared across processes, None disables it.
         """
         self.encoder = FastEmbedEncoder(name=os.environ.get('encoder_model'))
         self.qdrant_index = QdrantIndex(url=qdrant_url, api_key=qdrant_api_key, index_name=index_name, location=None)
         self.route_layer = None
+        self.routes = None
+        self.route_index_mode = route_index_mode
+        self.top_k = top_k
+        # local index: one normalized row per utterance, and the route each row belongs to
+        self.utterance_matrix = None
+        self.utterance_routes = None
+        self.route_thresholds = {}
+        self.embedding_cache = RouteEmbeddingCache(embedding_cache_dir, self.encoder.name) \
+            if embedding_cache_dir else None
 
     def setup_routes(self, routes):
         """
@@ -30,7 +53,124 @@ class SemanticRouter:
 
         :param routes: List of Route objects.
         """
+        self._set_routes(routes)
+        if self.embedding_cache:
+            self._setup_routes_from_cache(routes)
+            return
         self.route_layer = RouteLayer(encoder=self.encoder, routes=routes, index=self.qdrant_index)
+        if self.route_index_mode == 'local':
+            self.sync_local_index()
+
+    def _setup_routes_from_cache(self, routes):
+        route_names = [route.name for route in routes for _ in route.utterances]
+        utterances = [utterance for route in routes for utterance in route.utterances]
+        fingerprint = routes_fingerprint(route_names, utterances)
+
+        with self.embedding_cache.lock():
+            embeddings = self.embedding_cache.get_or_encode(utterances, encode=self.encoder)
+            # no RouteLayer here: it would re-encode and re-upload every utterance on each start,
+            # so remote decisions query the index directly instead
+            if not self._is_index_synced(fingerprint, expected_count=len(utterances)):
+                self._clear_index()
+                self.qdrant_index.add(embeddings=embeddings.tolist(), routes=route_names, utterances=utterances)
+                self.embedding_cache.mark_synced(self.qdrant_index.index_name, fingerprint)
+
+        if self.route_index_mode == 'local':
+            self._set_local_index(embeddings, route_names)
+
+    def _is_index_synced(self, fingerprint: str, expected_count: int) -> bool:
+        if not self.embedding_cache.is_synced(self.qdrant_index.index_name, fingerprint):
+            return False
+        # the cache can outlive the collection, so make sure qdrant still holds the points
+        client = self.qdrant_index.client
+        if not client.collection_exists(collection_name=self.qdrant_index.index_name):
+            return False
+        return client.count(collection_name=self.qdrant_index.index_name, exact=True).count == expected_count
+
+    def _clear_index(self):
+        # QdrantIndex assigns random point ids, so stale utterances have to be dropped before re-adding
+        client = self.qdrant_index.client
+        if client.collection_exists(collection_name=self.qdrant_index.index_name):
+            client.delete(collection_name=self.qdrant_index.index_name,
+                          points_selector=models.FilterSelector(filter=models.Filter()),
+                          wait=True)
+
+    def add_route(self, route):
+        """
+        Add a route to the routing layer, keeping the local index in step with Qdrant.
+
+        :param route: Route object.
+        """
+        if self.routes is None:
+            raise ValueError("Routes have not been set up. Call setup_routes() first.")
+        if self.embedding_cache:
+            self.setup_routes(self.routes + [route])
+            return
+        self.route_layer.add(route)
+        self._set_routes(self.route_layer.routes)
+        if self.route_index_mode == 'local':
+            self.sync_local_index()
+
+    def sync_local_index(self):
+        """
+        Pull every utterance vector from Qdrant into a normalized in-process matrix.
+        """
+        vectors, route_names = [], []
+        offset = None
+        while True:
+            points, offset = self.qdrant_index.client.scroll(
+                collection_name=self.qdrant_index.index_name,
+                with_payload=True,
+                with_vectors=True,
+                limit=256,
+                offset=offset,
+            )
+            for point in points:
+                vectors.append(point.vector)
+                route_names.append(point.payload[ROUTE_PAYLOAD_KEY])
+            if offset is None:
+                break
+
+        self._set_local_index(vectors, route_names)
+
+    def _set_local_index(self, vectors, route_names):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        self.utterance_matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.utterance_routes = np.asarray(route_names)
+
+    def _set_routes(self, routes):
+        self.routes = list(routes)
+        # routes without their own threshold fall back to the encoder default, as in RouteLayer
+        self.route_thresholds = {
+            route.name: route.score_threshold if route.score_threshold is not None else self.encoder.score_threshold
+            for route in self.routes
+        }
+
+    def _score(self, query_vectors: np.ndarray) -> np.ndarray:
+        # (num_queries, dim) x (dim, num_utterances) cosine scores in one matrix product
+        query_vectors = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+        return query_vectors @ self.utterance_matrix.T
+
+    def _classify(self, scores: np.ndarray):
+        top_k = min(self.top_k, len(scores))
+        top_indices = np.argpartition(-scores, top_k - 1)[:top_k]
+        return self._aggregate(scores[top_indices], self.utterance_routes[top_indices])
+
+    def _query_index(self, query_vector):
+        scores, route_names = self.qdrant_index.query(vector=np.asarray(query_vector), top_k=self.top_k)
+        if len(route_names) == 0:
+            return None
+        return self._aggregate(scores, route_names)
+
+    def _aggregate(self, scores, route_names):
+        # same aggregation as RouteLayer: sum the top utterance scores per route, then check the threshold
+        route_scores = defaultdict(list)
+        for score, name in zip(scores, route_names):
+            route_scores[name].append(float(score))
+        route_name, top_scores = max(route_scores.items(), key=lambda item: sum(item[1]))
+        if max(top_scores) >= self.route_thresholds.get(route_name, self.encoder.score_threshold):
+            return route_name
+        return None
 
     def route_query(self, query):
         """
@@ -39,7 +179,31 @@ class SemanticRouter:
         :param query: The input query string.
         :return: Name of the routed route.
         """
-        if not self.route_layer:
+        if self.routes is None:
             raise ValueError("Routes have not been set up. Call setup_routes() first.")
+        if self.route_index_mode == 'local':
+            query_vector = np.asarray(self.encoder([query]), dtype=np.float32)
+            return self._classify(self._score(query_vector)[0])
+        if not self.route_layer:
+            return self._query_index(self.encoder([query])[0])
         result = self.route_layer(query)
         return result.name
+
+    def route_queries(self, queries):
+        """
+        Route a batch of queries, encoding all of them in a single encoder call.
+
+        :param queries: List of input query strings.
+        :return: List of routed route names, in the order of the queries.
+        """
+        if self.routes is None:
+            raise ValueError("Routes have not been set up. Call setup_routes() first.")
+        if not queries:
+            return []
+        query_vectors = self.encoder(list(queries))
+        if self.route_index_mode == 'local':
+            scores = self._score(np.asarray(query_vectors, dtype=np.float32))
+            return [self._classify(row) for row in scores]
+        if not self.route_layer:
+            return [self._query_index(vector) for vector in query_vectors]
+        return [self.route_layer(vector=vector).name for vector in query_vectors]
@@ -9,6 +9,12 @@ simple_search = SimpleSearch(collection_name=os.environ['COLLECTION_NAME'])
 
 # open the below insert for the first time to index the data
 # simple_search.insert()
+# large files are streamed, use parallel embedding workers to speed them up
+# simple_search.insert(payload_path='data/startups.json', batch_size=256, parallel=0)
 
 result = simple_search.search(input_text="Chicago")
+print(result)
+
+# filters run against the payload indexes declared in PAYLOAD_INDEXES
+result = simple_search.search(input_text="AI startups", filters={"city": ["Chicago", "Berlin"]})
 print(result)
\ No newline at end of file
@@ -1,5 +1,6 @@
 import os
 import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from tqdm import tqdm
 from qdrant_client import qdrant_client, models
 from dotenv import find_dotenv, load_dotenv
@@ -7,19 +8,35 @@ from qdrant_client.http.models import Distance
 from qdrant_client.conversions.common_types import QueryResponse, UpdateResult
 
 
+# payload index types that can be declared for metadata fields
+PAYLOAD_SCHEMA_TYPES = {
+    "keyword": models.PayloadSchemaType.KEYWORD,
+    "integer": models.PayloadSchemaType.INTEGER,
+    "geo": models.PayloadSchemaType.GEO,
+}
+
+
+def _parse_payload_indexes(value: Optional[str]) -> Dict[str, str]:
+    # PAYLOAD_INDEXES='city:keyword,founded:integer,location:geo'
+    if not value:
+        return {}
+    return dict(item.strip().split(":", 1) for item in value.split(",") if item.strip())
+
+
 class SimpleSearch:
     _ = load_dotenv(find_dotenv())
 
-    def __init__(self, collection_name: str, vector_dimension: int = 384, distance: Distance = models.Distance.COSINE):
+    def __init__(self, collection_name: str, vector_dimension: int = 384, distance: Distance = models.Distance.COSINE,
+                 payload_indexes: Dict[str, str] = None):
         self.client = qdrant_client.QdrantClient(url=os.environ['DB_URL'], api_key=os.environ['DB_API_KEY'])
         # set the dense and sparse embedding models
         self.client.set_model(os.environ.get('DENSE_MODEL'))
         self.vector_dimension = vector_dimension
         self.distance = distance
         self.collection_name = collection_name
-
-        self.documents = []
-        self.metadata = []
+        # field name -> one of PAYLOAD_SCHEMA_TYPES, so filtered searches use an index instead of scanning payloads
+        self.payload_indexes = payload_indexes if payload_indexes is not None \
+            else _parse_payload_indexes(os.environ.get('PAYLOAD_INDEXES'))
 
         self._create_collection(collection_name=collection_name)
 
@@ -29,33 +46,87 @@ class SimpleSearch:
                 collection_name=collection_name,
                 vectors_config=self.client.get_fastembed_vector_params()
             )
+        self._create_payload_indexes(collection_name=collection_name)
 
-    def _read_data(self):
-        payload_path = "data/startups-mini.json"
+    def _create_payload_indexes(self, collection_name):
+        # indexes are also added to existing collections, qdrant builds them over the points already stored
+        existing_indexes = self.client.get_collection(collection_name=collection_name).payload_schema
+        for field_name, schema_type in self.payload_indexes.items():
+            if schema_type not in PAYLOAD_SCHEMA_TYPES:
+                raise ValueError(f"unsupported payload index type '{schema_type}' for field '{field_name}', "
+                                 f"expected one of {list(PAYLOAD_SCHEMA_TYPES)}")
+            if field_name in existing_indexes:
+                continue
+            self.client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=PAYLOAD_SCHEMA_TYPES[schema_type]
+            )
 
+    @staticmethod
+    def _read_data(payload_path: str, chunk_size: int) -> Iterator[Tuple[List[str], List[Dict]]]:
+        # the file is read chunk_size lines at a time, so memory is bounded by one chunk
+        documents, metadata = [], []
         with open(payload_path) as fd:
             for line in fd:
                 obj = json.loads(line)
-                self.documents.append(obj.pop("description"))
-                self.metadata.append(obj)
+                documents.append(obj.pop("description"))
+                metadata.append(obj)
+                if len(documents) == chunk_size:
+                    yield documents, metadata
+                    documents, metadata = [], []
+        if documents:
+            yield documents, metadata
 
-    def insert(self) -> UpdateResult:
-        self._read_data()
+    def insert(self, payload_path: str = "data/startups-mini.json", batch_size: int = 128,
+               parallel: Optional[int] = None, chunk_size: int = 4096) -> UpdateResult:
         # simple boilerplate code adjust it accordingly
-        self.client.add(
-            collection_name=self.collection_name,
-            documents=self.documents,
-            metadata=self.metadata,
-            batch_size=128,  # a batch os 128 embeddings will be pushed in a single request
-            ids=tqdm(range(len(self.documents)))
-        )
+        offset = 0
+        with tqdm() as progress:
+            for documents, metadata in self._read_data(payload_path, chunk_size=chunk_size):
+                # add() can read the documents more than once (e.g. for dense and sparse embeddings), so it gets lists
+                self.client.add(
+                    collection_name=self.collection_name,
+                    documents=documents,
+                    metadata=metadata,
+                    batch_size=batch_size,  # a batch of batch_size embeddings will be pushed in a single request
+                    parallel=parallel,  # number of fastembed worker processes, 0 uses all cores, None embeds in-process
+                    ids=range(offset, offset + len(documents))
+                )
+                offset += len(documents)
+                progress.update(len(documents))
+
+    @staticmethod
+    def _build_condition(field_name: str, value: Any) -> models.FieldCondition:
+        if isinstance(value, dict) and {"lat", "lon", "radius"} <= value.keys():
+            # geo fields: {"lat": .., "lon": .., "radius": meters}
+            return models.FieldCondition(
+                key=field_name,
+                geo_radius=models.GeoRadius(center=models.GeoPoint(lat=value["lat"], lon=value["lon"]),
+                                            radius=value["radius"])
+            )
+        if isinstance(value, dict):
+            # integer fields: any of {"gt", "gte", "lt", "lte"}
+            return models.FieldCondition(key=field_name, range=models.Range(**value))
+        if isinstance(value, (list, tuple, set)):
+            return models.FieldCondition(key=field_name, match=models.MatchAny(any=list(value)))
+        return models.FieldCondition(key=field_name, match=models.MatchValue(value=value))
+
+    def build_filter(self, filters: Optional[Dict[str, Any]]) -> Optional[models.Filter]:
+        """
+        Turn {"city": "Berlin", "industry": ["AI", "Fintech"], "founded": {"gte": 2015}} into a qdrant filter,
+        every entry has to match.
+        """
+        if not filters:
+            return None
+        return models.Filter(must=[self._build_condition(field_name, value) for field_name, value in filters.items()])
 
-    def search(self, input_text: str) -> QueryResponse:
+    def search(self, input_text: str, filters: Optional[Dict[str, Any]] = None, limit: int = 5) -> QueryResponse:
         search_result = self.client.query(
             collection_name=self.collection_name,
             query_text=input_text,
-            query_filter=None,  # If you don't want any filters for now
-            limit=5,  # 5 the closest results
+            query_filter=self.build_filter(filters),  # None searches the whole collection
+            limit=limit,  # 5 the closest results by default
         )
         # `search_result` contains found vector ids with similarity scores
         # along with the stored payload